@@ -0,0 +1,150 @@
+"""Admission control for /chat, /chat/batch and /upload_pdf.
+
+Each kind of work gets its own concurrency pool, so a burst of chats cannot
+block indexing, a few large scanned PDFs (OCR + embedding) cannot starve
+chat, and batch jobs cannot take interactive chat slots. A request that finds its pool full waits in a bounded queue for at
+most the pool's queue timeout; when the queue is full or the wait times out
+it is rejected with 429 and a Retry-After estimate. On top of that, each
+session_id has a token bucket limiting how fast it may send chats, and each
+client address one limiting how often it may submit batches.
+
+Limits are per process: with several workers, each enforces them separately.
+"""
+import math
+import time
+import asyncio
+import logging
+import threading
+
+from config import (
+    CHAT_MAX_CONCURRENCY, CHAT_MAX_QUEUE, CHAT_QUEUE_TIMEOUT,
+    INDEX_MAX_CONCURRENCY, INDEX_MAX_QUEUE, INDEX_QUEUE_TIMEOUT,
+    SESSION_RATE_PER_MINUTE, SESSION_RATE_BURST,
+    BATCH_MAX_REQUESTS, BATCH_MAX_QUEUE, BATCH_QUEUE_TIMEOUT, BATCH_RATE_PER_MINUTE, BATCH_RATE_BURST,
+)
+from metrics import record_stage, ADMISSION_QUEUE_DEPTH, ADMISSION_IN_FLIGHT, ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_AFTER = 300  # Seconds; upper bound of the Retry-After estimate
+
+
+class Overloaded(Exception):
+    """Request rejected by admission control; `retry_after` is in whole seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = min(max(math.ceil(retry_after), 1), MAX_RETRY_AFTER)
+
+
+class Slot:
+    """A held pool slot; release() is idempotent so it can sit in several finally blocks"""
+
+    def __init__(self, pool: "AdmissionPool"):
+        self._pool = pool
+        self._start = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._pool._release(time.perf_counter() - self._start)
+
+
+class AdmissionPool:
+    """At most `concurrency` requests at a time, `max_queue` waiting for up to `queue_timeout` seconds"""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._waiting = 0
+        self._avg_hold = None  # Moving average of how long a slot is held, for Retry-After
+        ADMISSION_QUEUE_DEPTH.set(0, name)
+        ADMISSION_IN_FLIGHT.set(0, name)
+
+    def retry_after(self) -> float:
+        """Rough time until a new request would get a slot"""
+        if self._avg_hold is None:
+            return self.queue_timeout
+        return self._avg_hold * (self._waiting + 1) / self.concurrency
+
+    async def acquire(self) -> Slot:
+        """Wait for a slot; raises Overloaded when the queue is full or the wait times out"""
+        if not self._semaphore.locked():
+            # Free slot: Semaphore.acquire() takes it without suspending
+            await self._semaphore.acquire()
+            ADMISSION_IN_FLIGHT.inc(1, self.name)
+            return Slot(self)
+        if self._waiting >= self.max_queue:
+            self._reject("queue_full")
+
+        self._waiting += 1
+        ADMISSION_QUEUE_DEPTH.inc(1, self.name)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout")
+        finally:
+            self._waiting -= 1
+            ADMISSION_QUEUE_DEPTH.dec(1, self.name)
+            record_stage(f"{self.name}_queue", time.perf_counter() - start)
+
+        ADMISSION_IN_FLIGHT.inc(1, self.name)
+        return Slot(self)
+
+    def _release(self, held_seconds: float):
+        self._avg_hold = held_seconds if self._avg_hold is None else 0.8 * self._avg_hold + 0.2 * held_seconds
+        ADMISSION_IN_FLIGHT.dec(1, self.name)
+        self._semaphore.release()
+
+    def _reject(self, reason: str):
+        ADMISSION_REJECTED.inc(1, self.name, reason)
+        logger.warning("Request rejected", extra={'pool': self.name, 'reason': reason, 'waiting': self._waiting})
+        raise Overloaded(reason, self.retry_after())
+
+
+class SessionRateLimiter:
+    """Token bucket per key (session_id): `rate_per_minute` sustained, bursts of up to `burst`"""
+
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, last update)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, pool: str = "chat"):
+        """Consume one token for `key`; raises Overloaded when its bucket is empty"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            else:
+                self._buckets[key] = (tokens - 1, now)
+                wait = None
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        if wait is not None:
+            ADMISSION_REJECTED.inc(1, pool, "rate_limited")
+            raise Overloaded("rate_limited", wait)
+
+    def _prune(self, now: float):
+        # Buckets that have refilled completely are equivalent to new ones
+        self._buckets = {k: v for k, v in self._buckets.items() if v[0] + (now - v[1]) * self.rate < self.burst}
+
+
+chat_pool = AdmissionPool("chat", CHAT_MAX_CONCURRENCY, CHAT_MAX_QUEUE, CHAT_QUEUE_TIMEOUT)
+index_pool = AdmissionPool("index", INDEX_MAX_CONCURRENCY, INDEX_MAX_QUEUE, INDEX_QUEUE_TIMEOUT)
+batch_pool = AdmissionPool("batch", BATCH_MAX_REQUESTS, BATCH_MAX_QUEUE, BATCH_QUEUE_TIMEOUT)
+session_limiter = SessionRateLimiter(SESSION_RATE_PER_MINUTE, SESSION_RATE_BURST)
+batch_limiter = SessionRateLimiter(BATCH_RATE_PER_MINUTE, BATCH_RATE_BURST)
@@ -0,0 +1,50 @@
+"""Leveled, structured (logfmt) logging for the backend.
+
+Usage:
+    logger = logging.getLogger(__name__)
+    logger.info("retrieved context", extra={'rag_hits': 4, 'convo_hits': 0})
+
+Fields passed via `extra` are rendered as `key=value` pairs after the message.
+"""
+import logging
+import sys
+
+# Attributes present on every LogRecord; anything else came from `extra`
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _quote(value) -> str:
+    text = str(value)
+    if text == '' or any(c in text for c in ' ="\n'):
+        text = '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return text
+
+
+class LogfmtFormatter(logging.Formatter):
+    """Format records as `ts=... level=... logger=... msg="..." key=value ...`"""
+
+    def format(self, record):
+        fields = [
+            ('ts', self.formatTime(record, '%Y-%m-%dT%H:%M:%S')),
+            ('level', record.levelname),
+            ('logger', record.name),
+            ('msg', record.getMessage()),
+        ]
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                fields.append((key, value))
+        line = ' '.join(f"{key}={_quote(value)}" for key, value in fields)
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging(level: str = "INFO"):
+    """Install the logfmt handler on the root logger (idempotent)"""
+    root = logging.getLogger()
+    if not any(getattr(h, '_chatbot_handler', False) for h in root.handlers):
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(LogfmtFormatter())
+        handler._chatbot_handler = True
+        root.addHandler(handler)
+    root.setLevel(level.upper())
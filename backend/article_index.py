@@ -0,0 +1,162 @@
+"""Precomputed statute article index: law name + article number -> chunks.
+
+Built at ingestion from the `article`/`articles` metadata the chunker puts
+on statute chunks, and persisted next to the vectorstore as JSON (including
+the chunk texts). Direct lookups such as "建築基準法第20条とは" are answered
+from memory without embedding or vector search; anything else falls
+through to semantic retrieval.
+
+Only main-body articles are indexed: 附則 (supplementary provision)
+articles restart their numbering and are left to vector search.
+"""
+import os
+import re
+import json
+import logging
+import unicodedata
+from pathlib import Path
+from typing import List
+
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "article_index.json"
+
+_KANJI_DIGITS = {c: i for i, c in enumerate("〇一二三四五六七八九")}
+_KANJI_UNITS = {'十': 10, '百': 100, '千': 1000}
+_NUMBER = r"[0-9]+|[〇一二三四五六七八九十百千]+"
+# Matches 第二十条, 第20条, 20条, 第五条の二, 第77条の58 (after NFKC normalization)
+ARTICLE_REF_RE = re.compile(rf"第?\s*({_NUMBER})\s*条((?:\s*の\s*(?:{_NUMBER}))*)")
+_BRANCH_RE = re.compile(rf"の\s*({_NUMBER})")
+# A law name followed by one of these refers to a different instrument (e.g. 建築基準法施行令)
+_DERIVED_SUFFIXES = ("施行令", "施行規則", "施行法")
+
+
+def _to_int(number: str) -> int:
+    """Parse Arabic or kanji numerals (二十三, 百二, 二〇)"""
+    if number.isdigit():
+        return int(number)
+    total, current = 0, 0
+    for ch in number:
+        if ch in _KANJI_DIGITS:
+            current = current * 10 + _KANJI_DIGITS[ch]
+        else:
+            total += (current or 1) * _KANJI_UNITS[ch]
+            current = 0
+    return total + current
+
+
+def _key(main: str, branches: str = "") -> str:
+    """Canonical article key: 第五条の二 -> "5-2" """
+    parts = [_to_int(main)] + [_to_int(b) for b in _BRANCH_RE.findall(branches)]
+    return "-".join(str(p) for p in parts)
+
+
+def article_key(label: str) -> str | None:
+    """Canonical key of an article label such as 第二十条 or 第５条の２"""
+    match = ARTICLE_REF_RE.search(unicodedata.normalize("NFKC", label))
+    return _key(match.group(1), match.group(2)) if match else None
+
+
+def law_name(source: str) -> str:
+    """Law name of a statute file: 建築基準法.pdf -> 建築基準法"""
+    return unicodedata.normalize("NFKC", Path(str(source)).stem)
+
+
+class ArticleIndex:
+    """In-memory article lookup table persisted as JSON in the vectorstore directory"""
+
+    def __init__(self, directory: Path):
+        self.path = Path(directory) / INDEX_FILE
+        self.laws = {}   # law name -> {article key -> [chunk_id, ...] in document order}
+        self.chunks = {}  # chunk_id -> {"text", "metadata"}
+
+    @classmethod
+    def load(cls, directory: Path) -> "ArticleIndex":
+        index = cls(directory)
+        if index.path.exists():
+            try:
+                data = json.loads(index.path.read_text(encoding="utf-8"))
+                index.laws, index.chunks = data["laws"], data["chunks"]
+            except Exception as e:
+                logger.error("Failed to load article index", extra={'path': str(index.path), 'error': str(e)})
+        return index
+
+    def save(self):
+        """Write the index atomically so other processes never read a partial file"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{INDEX_FILE}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"laws": self.laws, "chunks": self.chunks}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return sum(len(articles) for articles in self.laws.values())
+
+    def rebuild(self, chunks: List[Document]):
+        """Replace the whole index with the articles found in `chunks`"""
+        self.laws, self.chunks = {}, {}
+        self._add(chunks)
+
+    def update_sources(self, chunks: List[Document]):
+        """Replace the entries of every law that appears in `chunks` (incremental indexing)"""
+        for name in {law_name(c.metadata.get('source', '')) for c in chunks}:
+            for ids in self.laws.pop(name, {}).values():
+                for chunk_id in ids:
+                    self.chunks.pop(chunk_id, None)
+        self._add(chunks)
+
+    def _add(self, chunks: List[Document]):
+        for chunk in chunks:
+            metadata = chunk.metadata
+            if not metadata.get('articles') or metadata.get('supplementary'):
+                continue
+            articles = self.laws.setdefault(law_name(metadata.get('source', '')), {})
+            for label in metadata['articles'].split(","):
+                key = article_key(label)
+                if key is None:
+                    continue
+                ids = articles.setdefault(key, [])
+                if metadata['chunk_id'] not in ids:
+                    ids.append(metadata['chunk_id'])
+            self.chunks[metadata['chunk_id']] = {"text": chunk.page_content, "metadata": metadata}
+
+    def lookup(self, query: str, max_chunks: int) -> List[Document]:
+        """Chunks of the articles a query names explicitly ("<law>第N条"), or [] if it names none.
+
+        Each article reference is paired with the nearest law name before it;
+        a reference without one uses the query's only law name, if it has exactly one.
+        """
+        if not self.laws:
+            return []
+        text = unicodedata.normalize("NFKC", query)
+
+        mentions = []  # (position, law name)
+        for name in sorted(self.laws, key=len, reverse=True):
+            for match in re.finditer(re.escape(name), text):
+                start, end = match.span()
+                if text.startswith(_DERIVED_SUFFIXES, end):
+                    continue
+                if any(s <= start < e for s, e, _ in mentions):
+                    continue  # inside a longer law name already matched
+                mentions.append((start, end, name))
+        if not mentions:
+            return []
+
+        ids = []
+        for ref in ARTICLE_REF_RE.finditer(text):
+            preceding = [m for m in mentions if m[1] <= ref.start()]
+            if preceding:
+                name = max(preceding)[2]
+            elif len({m[2] for m in mentions}) == 1:
+                name = mentions[0][2]
+            else:
+                continue
+            for chunk_id in self.laws[name].get(_key(ref.group(1), ref.group(2)), []):
+                if chunk_id not in ids:
+                    ids.append(chunk_id)
+
+        return [
+            Document(page_content=self.chunks[i]["text"], metadata=self.chunks[i]["metadata"])
+            for i in ids[:max_chunks]
+        ]
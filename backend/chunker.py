@@ -0,0 +1,220 @@
+"""Page- and statute-aware chunking for Japanese documents.
+
+Replaces RecursiveCharacterTextSplitter, which splits unspaced Japanese at
+arbitrary character positions. Text is first grouped into blocks at statute
+headings (第…章/節/条 and the （見出し） caption before an article), then into
+paragraphs (項/号 markers), then sentences (。). Whole articles are packed
+together while they fit in `chunk_size`; longer articles are split at
+paragraph and sentence boundaries with `chunk_overlap` characters of
+trailing sentences carried over.
+
+Each chunk keeps the page it starts on (`page`, plus `page_end` when it
+spans pages), the articles it contains (`article`, `articles`; chunks from
+附則 supplementary provisions, whose article numbers restart, are flagged
+`supplementary`) and a deterministic content-hash `chunk_id`, so
+re-indexing can skip unchanged chunks and retrieval can dedupe exactly.
+"""
+import re
+import hashlib
+from pathlib import Path
+from typing import List
+
+from langchain.schema import Document
+
+_KANJI_NUM = "〇一二三四五六七八九十百千"
+_HEADING_NUM = rf"[{_KANJI_NUM}0-9０-９]+"
+SECTION_RE = re.compile(rf"^第{_HEADING_NUM}(?:編|章|節|款)(?:の{_HEADING_NUM})*[\s　]")
+ARTICLE_RE = re.compile(rf"^(第{_HEADING_NUM}条(?:の{_HEADING_NUM})*)[\s　]")
+CAPTION_RE = re.compile(r"^（[^（）]{1,40}）$")
+# 附則 heading in the body (the table of contents writes it without the inner space)
+SUPPLEMENTARY_RE = re.compile(r"^附[\s　]+則")
+PARAGRAPH_RE = re.compile(rf"^(?:[0-9０-９]+|[{_KANJI_NUM}]+)[\s　]")
+SENTENCE_RE = re.compile(r"[^。！？]*[。！？]+|[^。！？]+$")
+
+
+# Metadata that distinguishes otherwise identical text (sheets, conversation turns)
+_ID_FIELDS = ('sheet', 'page', 'session', 'role', 'timestamp')
+
+
+def chunk_id(metadata: dict, text: str) -> str:
+    """Deterministic ID for a chunk: hash of source file name, page and content"""
+    parts = [Path(str(metadata.get('source', ''))).name]
+    parts += [str(metadata.get(field, '')) for field in _ID_FIELDS]
+    parts.append(text)
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+def _join_wrapped(prev: str, line: str) -> str:
+    # PDF text layers wrap long Japanese sentences across lines; rejoin them
+    # without a separator unless both sides look like spaced (ASCII) text
+    if prev and line and (prev[-1].isascii() and line[0].isascii()):
+        return prev + " " + line
+    return prev + line
+
+
+def _group_key(doc: Document):
+    # Pages of one file (or sheet) are chunked as one text; separate conversation turns are not
+    return (doc.metadata.get('source'),) + tuple(doc.metadata.get(f) for f in _ID_FIELDS if f != 'page')
+
+
+class _Unit:
+    """A paragraph (or heading line) of text with the page it came from"""
+
+    def __init__(self, text: str, page):
+        self.text = text
+        self.page = page
+
+
+class _Block:
+    """Consecutive units that belong together: one article, or one heading-free run of text"""
+
+    def __init__(self, article: str | None = None, supplementary: bool = False):
+        self.units: List[_Unit] = []
+        self.article = article
+        self.supplementary = supplementary
+
+    def __len__(self):
+        return sum(len(u.text) for u in self.units) + max(len(self.units) - 1, 0)
+
+
+class DocumentChunker:
+    """Drop-in replacement for a LangChain text splitter's split_documents()"""
+
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        """Chunk documents, treating consecutive pages of the same source (and sheet/turn) as one text"""
+        chunks, seen = [], set()
+        group: List[Document] = []
+        for doc in documents:
+            if group and _group_key(doc) != _group_key(group[0]):
+                chunks.extend(self._split_source(group))
+                group = []
+            group.append(doc)
+        if group:
+            chunks.extend(self._split_source(group))
+
+        # Identical chunks (same source, page and text) collapse to one
+        unique = []
+        for chunk in chunks:
+            if chunk.metadata['chunk_id'] not in seen:
+                seen.add(chunk.metadata['chunk_id'])
+                unique.append(chunk)
+        return unique
+
+    def _blocks(self, docs: List[Document]) -> List[_Block]:
+        """Group the lines of one source's pages into heading-delimited blocks of paragraphs"""
+        rejoin_wrapped = str(docs[0].metadata.get('source', '')).lower().endswith('.pdf')
+        blocks = [_Block()]
+        supplementary = False
+        for doc in docs:
+            page = doc.metadata.get('page')
+            for raw in doc.page_content.splitlines():
+                line = raw.strip()
+                if not line:
+                    continue
+                block = blocks[-1]
+                article = ARTICLE_RE.match(line)
+                if SUPPLEMENTARY_RE.match(line):
+                    supplementary = True
+                if SECTION_RE.match(line) or CAPTION_RE.match(line) or SUPPLEMENTARY_RE.match(line):
+                    block = _Block(supplementary=supplementary)
+                    blocks.append(block)
+                elif article:
+                    # An article heading right after its caption stays in the caption's block
+                    caption_only = len(block.units) == 1 and CAPTION_RE.match(block.units[0].text) and block.article is None
+                    if not caption_only:
+                        block = _Block(supplementary=supplementary)
+                        blocks.append(block)
+                    block.article = article.group(1)
+
+                starts_unit = (
+                    not block.units or not rejoin_wrapped or article is not None
+                    or PARAGRAPH_RE.match(line) or CAPTION_RE.match(block.units[-1].text)
+                )
+                if starts_unit:
+                    block.units.append(_Unit(line, page))
+                else:
+                    block.units[-1].text = _join_wrapped(block.units[-1].text, line)
+        return [b for b in blocks if b.units]
+
+    def _pieces(self, block: _Block):
+        """Split an oversized block into (text, page, separator) pieces no longer than chunk_size"""
+        pieces = []
+        for unit in block.units:
+            if len(unit.text) <= self.chunk_size:
+                pieces.append((unit.text, unit.page, "\n"))
+                continue
+            first = True
+            for sentence in SENTENCE_RE.findall(unit.text):
+                step = max(self.chunk_size - self.chunk_overlap, 1)
+                for start in range(0, len(sentence), step):
+                    part = sentence[start:start + self.chunk_size]
+                    pieces.append((part, unit.page, "\n" if first else ""))
+                    first = False
+                    if start + self.chunk_size >= len(sentence):
+                        break
+        return pieces
+
+    def _split_source(self, docs: List[Document]) -> List[Document]:
+        base_metadata = {k: v for k, v in docs[0].metadata.items() if k != 'page'}
+        chunks = []
+        current: List[_Block] = []
+
+        def emit(pieces, articles, supplementary=False):
+            text = ""
+            for piece_text, _, sep in pieces:
+                text = (text + sep + piece_text) if text else piece_text
+            pages = [p for _, p, _ in pieces if p is not None]
+            metadata = dict(base_metadata)
+            if pages:
+                metadata['page'] = pages[0]
+                if pages[-1] != pages[0]:
+                    metadata['page_end'] = pages[-1]
+            if articles:
+                metadata['article'] = articles[0]
+                metadata['articles'] = ",".join(articles)
+            if supplementary:
+                metadata['supplementary'] = True
+            metadata['chunk_id'] = chunk_id(metadata, text)
+            chunks.append(Document(page_content=text, metadata=metadata))
+
+        def flush():
+            if current:
+                pieces = [(u.text, u.page, "\n") for b in current for u in b.units]
+                emit(pieces, [b.article for b in current if b.article], any(b.supplementary for b in current))
+                current.clear()
+
+        for block in self._blocks(docs):
+            # Pack whole blocks (articles) together while they fit
+            too_long = sum(len(b) + 1 for b in current) + len(block) > self.chunk_size
+            if current and (too_long or current[-1].supplementary != block.supplementary):
+                flush()
+            if len(block) <= self.chunk_size:
+                current.append(block)
+                continue
+
+            # Oversized article: split at paragraph/sentence boundaries with overlap
+            articles = [block.article] if block.article else []
+            window, size = [], 0
+            for piece in self._pieces(block):
+                if window and size + len(piece[0]) + 1 > self.chunk_size:
+                    emit(window, articles, block.supplementary)
+                    # Carry trailing pieces (up to chunk_overlap chars) into the next chunk
+                    carried, carried_size = [], 0
+                    for prev in reversed(window):
+                        if carried_size + len(prev[0]) > self.chunk_overlap:
+                            break
+                        carried.insert(0, prev)
+                        carried_size += len(prev[0]) + 1
+                    while carried and carried_size + len(piece[0]) + 1 > self.chunk_size:
+                        carried_size -= len(carried.pop(0)[0]) + 1
+                    window, size = carried, carried_size
+                window.append(piece)
+                size += len(piece[0]) + 1
+            if window:
+                emit(window, articles, block.supplementary)
+        flush()
+        return chunks
@@ -1,6 +1,8 @@
 import os
+import logging
 from pathlib import Path
 from dotenv import load_dotenv
+from app_logging import configure_logging
 
 # Paths
 BASE_DIR = Path(__file__).parent.parent
@@ -12,17 +14,21 @@ load_dotenv(dotenv_path=ENV_PATH)
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Debug: Check if .env file exists and API key is loaded
+# Logging
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+configure_logging(LOG_LEVEL)
+logger = logging.getLogger("config")
+
+# Check if .env file exists and API key is loaded
 if not ENV_PATH.exists():
-    print(f"WARNING: .env file not found at {ENV_PATH}")
+    logger.warning(".env file not found", extra={'path': str(ENV_PATH)})
 else:
-    print(f"✓ .env file found at {ENV_PATH}")
+    logger.info(".env file found", extra={'path': str(ENV_PATH)})
 
 if not OPENAI_API_KEY:
-    print("ERROR: OPENAI_API_KEY not loaded from .env file!")
-    print(f"Please check {ENV_PATH} file")
+    logger.error("OPENAI_API_KEY not loaded from .env file", extra={'path': str(ENV_PATH)})
 else:
-    print(f"✓ OPENAI_API_KEY loaded (length: {len(OPENAI_API_KEY)} chars)")
+    logger.info("OPENAI_API_KEY loaded", extra={'length': len(OPENAI_API_KEY)})
 
 # Server Configuration
 HOST = os.getenv("HOST", "0.0.0.0")
@@ -32,8 +38,8 @@ PORT = int(os.getenv("PORT", 8000))
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
 
 # Additional paths
-KNOWLEDGE_BASE_PATH = BASE_DIR / "knowledge base main"
-VECTORSTORE_PATH = BASE_DIR / "data" / "vectorstore"
+KNOWLEDGE_BASE_PATH = Path(os.getenv("KNOWLEDGE_BASE_PATH", BASE_DIR / "knowledge base main"))
+VECTORSTORE_PATH = Path(os.getenv("VECTORSTORE_PATH", BASE_DIR / "data" / "vectorstore"))
 
 # Model Configuration
 GPT_MODEL = "gpt-4o-mini"
@@ -47,7 +53,70 @@ RESPONSE_TEMPERATURE = 0.3   # Temperature for response generation (0.0-1.0)
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 RETRIEVAL_K = 4
+# Queries naming a statute article ("建築基準法第20条") are answered from the
+# precomputed article index (backend/article_index.py) with at most this many chunks
+ARTICLE_LOOKUP_MAX_CHUNKS = 6
+
+# PDF Text Extraction
+# Pages whose text layer has fewer non-whitespace characters than this are OCR'd
+# (scanned pages); everything else is read from the text layer without OCR
+MIN_TEXT_LAYER_CHARS = int(os.getenv("MIN_TEXT_LAYER_CHARS", 20))
+# Adaptive OCR: pages are OCR'd at OCR_DPI and re-OCR'd at OCR_RETRY_DPI only when
+# Tesseract's mean word confidence (0-100) is below OCR_MIN_CONFIDENCE
+OCR_DPI = int(os.getenv("OCR_DPI", 200))
+OCR_RETRY_DPI = int(os.getenv("OCR_RETRY_DPI", 300))  # 0 disables the retry
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", 60))
+
+# Vector Store Backend for the knowledge base
+# chroma: Chroma/SQLite (default); mmap: memory-mapped NumPy index (backend/mmap_store.py),
+# loads in milliseconds and is shared across worker processes through the page cache
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+MMAP_INDEX_DTYPE = os.getenv("MMAP_INDEX_DTYPE", "float16")  # float16 or int8 (half the size, slightly lower precision)
 
 # Embedding Model
 EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
 
+
+# Batch Chat Configuration
+BATCH_MAX_QUESTIONS = 200      # Maximum questions accepted by /chat/batch in one request
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))  # Concurrent OpenAI calls per batch
+
+# Admission Control (per process)
+# /chat and /upload_pdf each get a concurrency pool; requests beyond it wait in a
+# bounded queue for at most the queue timeout and are then rejected with 429 + Retry-After
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", 16))  # Concurrent /chat requests (streams included)
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", 64))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", 10))  # Seconds
+INDEX_MAX_CONCURRENCY = int(os.getenv("INDEX_MAX_CONCURRENCY", 1))  # Concurrent /upload_pdf indexing runs (OCR + embedding)
+INDEX_MAX_QUEUE = int(os.getenv("INDEX_MAX_QUEUE", 4))
+INDEX_QUEUE_TIMEOUT = float(os.getenv("INDEX_QUEUE_TIMEOUT", 60))  # Seconds
+# Token bucket per session_id (per client address without one): sustained rate and burst size
+SESSION_RATE_PER_MINUTE = float(os.getenv("SESSION_RATE_PER_MINUTE", 20))  # 0 disables rate limiting
+SESSION_RATE_BURST = int(os.getenv("SESSION_RATE_BURST", 5))
+# /chat/batch has its own pool and per-client rate limit, so batch jobs never use /chat slots or tokens;
+# an admitted batch runs up to BATCH_MAX_CONCURRENCY completions
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 1))  # Concurrent /chat/batch requests
+BATCH_MAX_QUEUE = int(os.getenv("BATCH_MAX_QUEUE", 4))
+BATCH_QUEUE_TIMEOUT = float(os.getenv("BATCH_QUEUE_TIMEOUT", 60))  # Seconds
+BATCH_RATE_PER_MINUTE = float(os.getenv("BATCH_RATE_PER_MINUTE", 2))  # 0 disables rate limiting
+BATCH_RATE_BURST = int(os.getenv("BATCH_RATE_BURST", 2))
+
+# Session Store
+# Chat turns are appended to a SQLite (WAL) log; only salient user turns and the
+# summaries of compacted older turns are embedded into conversation memory, in the background
+SESSION_DB_PATH = Path(os.getenv("SESSION_DB_PATH", BASE_DIR / "data" / "sessions.db"))
+SESSION_KEEP_RECENT_TURNS = 20        # Turns kept verbatim per session; older ones are folded into a summary
+SESSION_SUMMARY_MAX_CHARS = 2000      # Maximum length of a session summary
+SESSION_SALIENT_MIN_CHARS = 10        # User turns at least this long are embedded for recall
+SESSION_TTL_DAYS = float(os.getenv("SESSION_TTL_DAYS", 30))  # Sessions idle this long are deleted
+SESSION_MAINTENANCE_INTERVAL = float(os.getenv("SESSION_MAINTENANCE_INTERVAL", 60))  # Seconds between embed/compact/expire passes
+
+# Multi-process Deployment
+# standalone: one process does everything (default)
+# query: serves /chat; embeddings and all index writes go to the indexer process
+# indexer: owns the embedding model and every vectorstore write (backend/indexer.py)
+WORKER_ROLE = os.getenv("WORKER_ROLE", "standalone")
+INDEXER_PORT = int(os.getenv("INDEXER_PORT", 8001))
+INDEXER_URL = os.getenv("INDEXER_URL", f"http://127.0.0.1:{INDEXER_PORT}")
+INDEXER_WAIT_SECONDS = int(os.getenv("INDEXER_WAIT_SECONDS", 600))  # How long query workers wait for the indexer at startup
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", 2.0))  # Min seconds between generation checks in query workers
@@ -0,0 +1,108 @@
+"""Coordination between query workers and the single indexer process.
+
+In multi-process mode (WORKER_ROLE=query / WORKER_ROLE=indexer):
+- the indexer owns every write to the vectorstores and the only copy of the
+  embedding model, which it serves to the workers over HTTP (/embed);
+- after each write it bumps the generation counter file of the store it
+  wrote (the knowledge base and conversation memory have separate counters);
+- query workers compare the counters before searching and reopen only the
+  store whose counter changed.
+"""
+import os
+import time
+import asyncio
+import logging
+from pathlib import Path
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+GENERATION_FILE = "GENERATION"
+CONVERSATION_GENERATION_FILE = "GENERATION.conversations"
+# Store name -> its generation counter file
+GENERATION_FILES = {'kb': GENERATION_FILE, 'conversations': CONVERSATION_GENERATION_FILE}
+
+
+def read_generation(persist_directory: Path, store: str = 'kb') -> int:
+    """Current generation of a store (0 if the indexer has not written one yet)"""
+    try:
+        return int((Path(persist_directory) / GENERATION_FILES[store]).read_text().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_generation(persist_directory: Path, store: str = 'kb') -> int:
+    """Atomically increment a store's generation counter so workers reload that store"""
+    persist_directory = Path(persist_directory)
+    persist_directory.mkdir(parents=True, exist_ok=True)
+    generation = read_generation(persist_directory, store) + 1
+    tmp_path = persist_directory / f"{GENERATION_FILES[store]}.{os.getpid()}.tmp"
+    tmp_path.write_text(str(generation))
+    os.replace(tmp_path, persist_directory / GENERATION_FILES[store])
+    return generation
+
+
+class RemoteEmbeddings:
+    """LangChain-compatible embeddings served by the indexer process.
+
+    Request handlers use aembed_documents so a slow indexer never blocks the
+    worker's event loop; the synchronous methods serve Chroma's text queries.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url
+        self.timeout = timeout
+        self._client = httpx.Client(base_url=base_url, timeout=timeout)
+        self._async_client = None  # Created on first use, inside the worker's event loop
+
+    def embed_documents(self, texts):
+        response = self._client.post("/embed", json={"texts": list(texts)})
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    async def aembed_documents(self, texts):
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+        response = await self._async_client.post("/embed", json={"texts": list(texts)})
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class IndexerClient:
+    """Forwards index writes from a query worker to the indexer process"""
+
+    def __init__(self, base_url: str, timeout: float = 600.0):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    async def _post(self, path: str, payload: dict) -> dict:
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout) as client:
+            response = await client.post(path, json=payload)
+            response.raise_for_status()
+            return response.json()
+
+    async def index_file(self, file_path: Path) -> bool:
+        return (await self._post("/index_file", {"path": str(file_path)}))["success"]
+
+    async def rebuild(self) -> bool:
+        return (await self._post("/rebuild", {}))["success"]
+
+    async def wait_until_ready(self, timeout: float) -> bool:
+        """Poll the indexer's /health until it answers or `timeout` seconds pass"""
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=5.0) as client:
+            while True:
+                try:
+                    response = await client.get("/health")
+                    if response.status_code == 200:
+                        return True
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    logger.error("Indexer not reachable", extra={'url': self.base_url, 'timeout': timeout})
+                    return False
+                await asyncio.sleep(1.0)
@@ -0,0 +1,108 @@
+"""Single-writer indexer process for multi-worker deployments.
+
+Run one of these next to any number of query workers:
+
+    WORKER_ROLE=indexer python -m uvicorn backend.indexer:app --port 8001
+    WORKER_ROLE=query   python -m uvicorn backend.main:app --port 8100   # one per port: 8100, 8101, ...
+
+It loads the embedding model once and serves it to the workers (/embed),
+performs every vectorstore write (uploads, conversation memory, rebuilds),
+and bumps the written store's generation after each write so workers reload
+that store (the knowledge base and conversation memory are tracked apart). Workers
+append chat turns to the shared session store; the indexer embeds, compacts
+and expires them in the background.
+"""
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+import asyncio
+import logging
+import sys
+from pathlib import Path
+
+# Add backend directory to Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from rag_system import RAGSystem
+from metrics import render_prometheus, span
+from index_sync import read_generation
+from session_store import SessionStore, run_maintenance
+from config import SESSION_MAINTENANCE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Japanese Knowledge Base Indexer")
+
+rag: RAGSystem | None = None
+# Serializes writes so the indexer is the single writer even under concurrent requests.
+# The writes themselves run in worker threads (see RAGSystem.create_vectorstore and
+# run_maintenance), so /embed keeps serving query workers during an upload or rebuild
+write_lock = asyncio.Lock()
+
+
+class EmbedRequest(BaseModel):
+    texts: list[str]
+
+class IndexFileRequest(BaseModel):
+    path: str
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Load the embedding model and build or open the vectorstores"""
+    global rag
+    logger.info("Initializing indexer")
+    rag = RAGSystem(role='indexer')
+    await rag.initialize()
+    asyncio.create_task(session_maintenance_loop())
+    logger.info("Indexer ready", extra={'generation': read_generation(rag.persist_directory)})
+
+async def session_maintenance_loop():
+    """Embed, compact and expire the chat sessions workers append to the session store"""
+    sessions = SessionStore()
+    while True:
+        await asyncio.sleep(SESSION_MAINTENANCE_INTERVAL)
+        try:
+            async with write_lock:
+                await run_maintenance(sessions, rag)
+        except Exception as e:
+            logger.error("Session maintenance failed", extra={'error': str(e)})
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "healthy",
+        "generation": read_generation(rag.persist_directory),
+        "conversation_generation": read_generation(rag.persist_directory, 'conversations'),
+    }
+
+@app.post("/embed")
+def embed(request: EmbedRequest):
+    """Embed texts with the shared model (runs in the threadpool, off the event loop)"""
+    with span("embed_service"):
+        return {"embeddings": rag.embeddings.embed_documents(request.texts)}
+
+@app.post("/index_file")
+async def index_file(request: IndexFileRequest):
+    path = Path(request.path)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail=f"File not found: {path}")
+    async with write_lock:
+        success = await rag.add_documents_from_file(path)
+    return {"success": bool(success), "generation": read_generation(rag.persist_directory)}
+
+@app.post("/rebuild")
+async def rebuild():
+    async with write_lock:
+        await rag.create_vectorstore()
+    return {"success": True, "generation": read_generation(rag.persist_directory)}
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    from config import INDEXER_PORT
+    uvicorn.run(app, host="127.0.0.1", port=INDEXER_PORT)
@@ -1,16 +1,26 @@
 import os
+import time
 import asyncio
+import logging
 import subprocess
-from typing import AsyncGenerator
+from typing import AsyncGenerator, List
 from openai import AsyncOpenAI
 from rag_system import RAGSystem
-from config import OPENAI_API_KEY, GPT_MODEL, RAKUTEN_MODEL, MAX_RESPONSE_TOKENS, RESPONSE_TEMPERATURE
+from config import (
+    OPENAI_API_KEY, GPT_MODEL, RAKUTEN_MODEL, MAX_RESPONSE_TOKENS, RESPONSE_TEMPERATURE,
+    BATCH_MAX_CONCURRENCY,
+)
+from metrics import span, record_stage, PROMPT_TOKENS, PROMPT_CACHED_TOKENS
+from session_store import SessionStore
+
+logger = logging.getLogger(__name__)
 
 # Initialize OpenAI client
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 # Initialize RAG system
 rag = None
+sessions = None
 
 async def initialize_vector_db():
     """Initialize the RAG system"""
@@ -18,38 +28,102 @@ async def initialize_vector_db():
     rag = RAGSystem()
     await rag.initialize()
 
-async def query_gpt4o_mini_stream(user_query: str, context: str) -> AsyncGenerator[str, None]:
-    """Query GPT-4o-mini with streaming support"""
-    prompt = f"""あなたは日本の建築・法律に関する専門的な知識ベースアシスタントです。
+def get_session_store() -> SessionStore:
+    """The process-wide chat session log (opened on first use)"""
+    global sessions
+    if sessions is None:
+        sessions = SessionStore()
+    return sessions
+
+def record_turn(session_id: str, role: str, text: str):
+    """Append a turn to the session log (embedding into conversation memory happens later)"""
+    try:
+        get_session_store().append(session_id, role, text)
+    except Exception as e:
+        logger.warning("Failed to record conversation turn", extra={'session': session_id, 'role': role, 'error': str(e)})
+
+# Everything that does not depend on the request lives in the system message so it
+# forms an identical prefix across requests for OpenAI's automatic prompt caching
+SYSTEM_PROMPT = """あなたは論理的推論と知識検索を担当する専門アシスタントです。質問の内容に応じて、必要な詳細を全て含んだ包括的で正確な回答を提供してください。
+
+あなたは日本の建築・法律に関する専門的な知識ベースアシスタントです。
 提供されたコンテキストを使用して、質問に正確かつ詳細に答えてください。
+回答は日本語で、事実に基づいて包括的に答えてください。必要に応じて、詳細な説明、具体例、関連する法令や規則の引用を含めてください。"""
 
-コンテキスト:
+def build_messages(user_query: str, context: str) -> list:
+    """Build the chat messages sent to GPT-4o-mini for a query and its retrieved context.
+
+    Order is most-stable first: the fixed system prompt, then the retrieved
+    excerpts (in a deterministic order, see RAGSystem.retrieve_contexts), and the
+    question last, so requests that share excerpts also share a cacheable prefix.
+    """
+    prompt = f"""コンテキスト:
 {context}
 
 質問:
-{user_query}
-
-回答は日本語で、事実に基づいて包括的に答えてください。必要に応じて、詳細な説明、具体例、関連する法令や規則の引用を含めてください。"""
+{user_query}"""
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def record_usage(usage):
+    """Report prompt and cached-prompt token counts from a completion's usage to /metrics"""
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = (getattr(details, 'cached_tokens', None) or 0) if details is not None else 0
+    PROMPT_TOKENS.inc(usage.prompt_tokens or 0)
+    PROMPT_CACHED_TOKENS.inc(cached)
+    logger.debug("Completion usage", extra={'prompt_tokens': usage.prompt_tokens, 'cached_tokens': cached,
+                                            'completion_tokens': usage.completion_tokens})
 
+async def query_gpt4o_mini_stream(user_query: str, context: str) -> AsyncGenerator[str, None]:
+    """Query GPT-4o-mini with streaming support"""
+    start = time.perf_counter()
+    first_token = True
     try:
         stream = await client.chat.completions.create(
             model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": "あなたは論理的推論と知識検索を担当する専門アシスタントです。質問の内容に応じて、必要な詳細を全て含んだ包括的で正確な回答を提供してください。"},
-                {"role": "user", "content": prompt}
-            ],
+            messages=build_messages(user_query, context),
             stream=True,
+            stream_options={"include_usage": True},
             temperature=RESPONSE_TEMPERATURE,
             max_tokens=MAX_RESPONSE_TOKENS
         )
         
         async for chunk in stream:
-            if chunk.choices[0].delta.content:
+            # With include_usage the last chunk has no choices, only usage
+            if chunk.usage is not None:
+                record_usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token:
+                    record_stage("upstream_ttft", time.perf_counter() - start)
+                    first_token = False
                 yield chunk.choices[0].delta.content
                 
     except Exception as e:
-        print(f"Error in GPT-4o-mini: {e}")
+        logger.error("Error in GPT-4o-mini stream", extra={'error': str(e)})
         yield f"エラーが発生しました: {str(e)}"
+    finally:
+        record_stage("stream_total", time.perf_counter() - start)
+
+async def query_gpt4o_mini(user_query: str, context: str) -> str:
+    """Query GPT-4o-mini with a single non-streaming completion"""
+    try:
+        with span("upstream_completion"):
+            response = await client.chat.completions.create(
+                model=GPT_MODEL,
+                messages=build_messages(user_query, context),
+                temperature=RESPONSE_TEMPERATURE,
+                max_tokens=MAX_RESPONSE_TOKENS
+            )
+        record_usage(response.usage)
+        return response.choices[0].message.content or ""
+    except Exception as e:
+        logger.error("Error in GPT-4o-mini", extra={'error': str(e)})
+        return f"エラーが発生しました: {str(e)}"
 
 def refine_with_rakutenai(text: str) -> str:
     """Refine text with RakutenAI for natural Japanese"""
@@ -72,29 +146,26 @@ def refine_with_rakutenai(text: str) -> str:
         refined = result.stdout.strip()
         return refined if refined else text
     except subprocess.TimeoutExpired:
-        print("RakutenAI timeout - returning original text")
+        logger.warning("RakutenAI timeout - returning original text")
         return text
     except Exception as e:
-        print(f"Error in RakutenAI: {e} - returning original text")
+        logger.error("Error in RakutenAI - returning original text", extra={'error': str(e)})
         return text
 
 async def generate_response_stream(user_query: str, session_id: str | None = None) -> AsyncGenerator[str, None]:
     """Generate streaming response through the full pipeline.
 
-    If session_id is provided, the user turn and assistant turn will be added
-    to the conversation vectorstore so they become part of conversational memory.
+    If session_id is provided, the user turn and assistant turn are appended to
+    the session store; salient turns reach conversational memory in the background.
     """
 
     # Ensure RAG system initialized
     if rag is None:
         await initialize_vector_db()
 
-    # If session_id provided, log the user turn into conversation memory
-    if session_id is not None and rag is not None:
-        try:
-            await rag.add_conversation_turn(session_id, 'user', user_query)
-        except Exception as e:
-            print(f"Warning: failed to add user conversation turn: {e}")
+    # If session_id provided, log the user turn to the session store
+    if session_id is not None:
+        record_turn(session_id, 'user', user_query)
 
     # Step 1: Retrieve context from knowledge base + conversation memory
     context = await rag.retrieve_context(user_query) if rag is not None else ""
@@ -112,10 +183,47 @@ async def generate_response_stream(user_query: str, session_id: str | None = Non
     # This can be enabled for non-streaming responses
     # refined = await asyncio.to_thread(refine_with_rakutenai, draft_response)
 
-    # If session_id provided, add the assistant turn to conversation memory
-    if session_id is not None and rag is not None:
-        try:
-            await rag.add_conversation_turn(session_id, 'assistant', draft_response)
-        except Exception as e:
-            print(f"Warning: failed to add assistant conversation turn: {e}")
+    # If session_id provided, log the assistant turn to the session store
+    if session_id is not None:
+        record_turn(session_id, 'assistant', draft_response)
+
+async def generate_response(user_query: str, session_id: str | None = None) -> str:
+    """Generate a complete (non-streaming) response through the full pipeline.
+
+    Uses a single non-streaming completion call. Session handling matches
+    generate_response_stream: both turns are appended to the session store.
+    """
+    if rag is None:
+        await initialize_vector_db()
+
+    if session_id is not None:
+        record_turn(session_id, 'user', user_query)
+
+    context = await rag.retrieve_context(user_query) if rag is not None else ""
+    answer = await query_gpt4o_mini(user_query, context)
+
+    if session_id is not None:
+        record_turn(session_id, 'assistant', answer)
+
+    return answer
+
+async def generate_responses_batch(user_queries: List[str], max_concurrency: int = BATCH_MAX_CONCURRENCY) -> List[str]:
+    """Answer many independent questions at once.
+
+    Retrieval for all questions shares one batched query embedding, then the
+    completions are fanned out to OpenAI with at most `max_concurrency` calls
+    in flight. Batch questions are not written to conversation memory; a
+    question whose completion fails gets an error message as its answer.
+    """
+    if rag is None:
+        await initialize_vector_db()
+
+    contexts = await rag.retrieve_contexts(user_queries) if rag is not None else ["" for _ in user_queries]
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def answer_one(user_query: str, context: str) -> str:
+        async with semaphore:
+            return await query_gpt4o_mini(user_query, context)
 
+    return await asyncio.gather(*(answer_one(q, c) for q, c in zip(user_queries, contexts)))
@@ -1,17 +1,27 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 import json
+import time
 import asyncio
+import logging
 import sys
 from pathlib import Path
 
 # Add backend directory to Python path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from llm_pipeline import generate_response_stream, initialize_vector_db
-from config import KNOWLEDGE_BASE_PATH
+from llm_pipeline import (
+    generate_response_stream, generate_response, generate_responses_batch, initialize_vector_db, get_session_store,
+)
+from config import KNOWLEDGE_BASE_PATH, BATCH_MAX_QUESTIONS, BATCH_MAX_CONCURRENCY, WORKER_ROLE, SESSION_MAINTENANCE_INTERVAL
+from metrics import render_prometheus, start_request_timings, record_stage, format_server_timing
+from session_store import maintenance_loop
+from admission import Overloaded, chat_pool, index_pool, batch_pool, session_limiter, batch_limiter
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Japanese Knowledge Base Chatbot")
 
@@ -28,30 +38,74 @@ class ChatRequest(BaseModel):
     query: str
     stream: bool = True
     session_id: str | None = None
+    timings: bool = False  # Include per-stage timings (SSE trailer event or Server-Timing header)
+
+class BatchChatRequest(BaseModel):
+    queries: list[str]
+    max_concurrency: int | None = None
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Admission control rejections: 429 with a Retry-After estimate"""
+    return JSONResponse(
+        {"detail": "Server busy, please retry later", "reason": exc.reason},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+def _rate_limit_key(http_request: Request, session_id: str | None) -> str:
+    # Requests without a session_id share a bucket per client address
+    if session_id:
+        return f"session:{session_id}"
+    return f"client:{http_request.client.host if http_request.client else 'unknown'}"
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize vector database on startup"""
-    print("Initializing vector database...")
+    logger.info("Initializing vector database")
     await initialize_vector_db()
-    print("Vector database initialized!")
+    logger.info("Vector database initialized")
+
+    # Embedding, compaction and expiry of chat sessions run in the process that
+    # writes the index (the indexer does this in multi-worker mode)
+    if WORKER_ROLE != 'query':
+        from llm_pipeline import rag as pipeline_rag
+        asyncio.create_task(maintenance_loop(get_session_store(), pipeline_rag, SESSION_MAINTENANCE_INTERVAL))
 
 @app.get("/")
 async def root():
     return {"status": "ok", "message": "Japanese Knowledge Base Chatbot API"}
 
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """Handle chat requests with optional streaming"""
     if not request.query:
         raise HTTPException(status_code=400, detail="Query cannot be empty")
-    
+
+    # Admission control: a slot in the chat pool (held until the stream ends), then
+    # the per-session token bucket; both raise Overloaded -> 429. The token is only
+    # taken once the request is admitted, so a pool rejection costs the session nothing
+    slot = await chat_pool.acquire()
+    try:
+        session_limiter.take(_rate_limit_key(http_request, request.session_id))
+    except Overloaded:
+        slot.release()
+        raise
+
     if request.stream:
         # Return streaming response
         async def event_generator():
-            async for chunk in generate_response_stream(request.query, request.session_id):
-                yield f"data: {json.dumps({'text': chunk})}\n\n"
-            yield "data: [DONE]\n\n"
+            try:
+                timings = start_request_timings() if request.timings else None
+                start = time.perf_counter()
+                async for chunk in generate_response_stream(request.query, request.session_id):
+                    yield f"data: {json.dumps({'text': chunk})}\n\n"
+                record_stage("request_total", time.perf_counter() - start)
+                if timings is not None:
+                    yield f"data: {json.dumps({'timings': timings})}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                slot.release()
         
         return StreamingResponse(
             event_generator(),
@@ -60,19 +114,64 @@ async def chat(request: ChatRequest):
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
                 "X-Accel-Buffering": "no"
-            }
+            },
+            # Also releases the slot if the client disconnects before the stream starts
+            background=BackgroundTask(slot.release),
         )
     else:
-        # Return complete response
-        full_response = ""
-        async for chunk in generate_response_stream(request.query):
-            full_response += chunk
-        return {"answer": full_response}
+        # Return complete response from a single non-streaming completion
+        try:
+            timings = start_request_timings() if request.timings else None
+            start = time.perf_counter()
+            answer = await generate_response(request.query, request.session_id)
+            record_stage("request_total", time.perf_counter() - start)
+        finally:
+            slot.release()
+        if timings is not None:
+            return JSONResponse({"answer": answer}, headers={"Server-Timing": format_server_timing(timings)})
+        return {"answer": answer}
+
+@app.post("/chat/batch")
+async def chat_batch(request: BatchChatRequest, http_request: Request):
+    """Answer many questions in one request (used for FAQ regeneration and evaluation runs).
+
+    Retrieval for all questions uses one batched query embedding and the
+    OpenAI calls run with bounded concurrency. Answers are returned in the
+    same order as the questions.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="Queries cannot be empty")
+    if len(request.queries) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"Too many queries (max {BATCH_MAX_QUESTIONS})")
+    if any(not q for q in request.queries):
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    # Batches are admitted through their own pool and per-client rate limit, never
+    # /chat's, so batch jobs cannot lock out interactive chat. Once admitted the
+    # batch runs to completion; a failed question gets an error answer
+    slot = await batch_pool.acquire()
+    try:
+        batch_limiter.take(_rate_limit_key(http_request, None), pool="batch")
+        max_concurrency = min(request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+        answers = await generate_responses_batch(request.queries, max_concurrency=max_concurrency)
+    finally:
+        slot.release()
+    return {"results": [{"query": q, "answer": a} for q, a in zip(request.queries, answers)]}
+
+@app.get("/sessions/{session_id}")
+async def session_history(session_id: str, limit: int | None = None):
+    """Ordered turns of a chat session (the last `limit` if given) plus the summary of older turns"""
+    return get_session_store().history(session_id, limit=limit)
 
 @app.get("/health")
 async def health():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms in Prometheus text format"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 
 @app.post("/upload_pdf")
 async def upload_pdf(file: UploadFile = File(...)):
@@ -87,6 +186,17 @@ async def upload_pdf(file: UploadFile = File(...)):
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
+    # Indexing (OCR + embedding) runs in its own pool so uploads cannot starve chat;
+    # raises Overloaded -> 429 when the indexing queue is full
+    slot = await index_pool.acquire()
+    try:
+        return await _save_and_index(file)
+    finally:
+        slot.release()
+
+
+async def _save_and_index(file: UploadFile):
+    """Save an uploaded PDF and index it (called with an indexing slot held)"""
     uploads_dir = Path(KNOWLEDGE_BASE_PATH) / "uploads"
     uploads_dir.mkdir(parents=True, exist_ok=True)
 
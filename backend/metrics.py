@@ -0,0 +1,219 @@
+"""Lightweight in-process metrics with Prometheus text exposition.
+
+Stages of the pipeline are wrapped in `span("stage")`, which records the
+elapsed time in the `chatbot_stage_seconds` histogram and, when a request
+has opted in via `start_request_timings()`, in that request's timing dict.
+"""
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Default latency buckets (seconds): sub-millisecond lookups up to long OCR/indexing runs
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (100, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return "{" + inner + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    """Cumulative histogram keyed by label values"""
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def snapshot(self):
+        """Return {label_values: {'count': n, 'sum': seconds}} for every series"""
+        with self._lock:
+            return {label_values: {'count': series['count'], 'sum': series['sum']}
+                    for label_values, series in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    labels = _format_labels(self.label_names, label_values, ('le', _format_value(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return "\n".join(lines)
+
+
+class Counter:
+    """Monotonic counter keyed by label values"""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Gauge:
+    """Point-in-time value keyed by label values"""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, amount=1, *label_values):
+        self.inc(-amount, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+# Registry of all metrics exported on /metrics
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render_prometheus() -> str:
+    """Render every registered metric in Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+STAGE_SECONDS = register(Histogram(
+    "chatbot_stage_seconds",
+    "Time spent in each pipeline stage",
+    label_names=("stage",),
+))
+CONTEXT_CHARS = register(Histogram(
+    "chatbot_context_chars",
+    "Size of the retrieved context inserted into the prompt, in characters",
+    buckets=SIZE_BUCKETS,
+))
+ADMISSION_QUEUE_DEPTH = register(Gauge(
+    "chatbot_admission_queue_depth",
+    "Requests waiting for a slot in each admission pool",
+    label_names=("pool",),
+))
+ADMISSION_IN_FLIGHT = register(Gauge(
+    "chatbot_admission_in_flight",
+    "Requests holding a slot in each admission pool",
+    label_names=("pool",),
+))
+ADMISSION_REJECTED = register(Counter(
+    "chatbot_admission_rejected_total",
+    "Requests rejected with 429, by pool and reason (queue_full, queue_timeout, rate_limited)",
+    label_names=("pool", "reason"),
+))
+ARTICLE_LOOKUPS = register(Counter(
+    "chatbot_article_lookups_total",
+    "Queries answered from the article index (hit) or sent to vector search (miss)",
+    label_names=("result",),
+))
+PROMPT_TOKENS = register(Counter(
+    "chatbot_prompt_tokens_total",
+    "Prompt tokens sent upstream, from the completion usage",
+))
+PROMPT_CACHED_TOKENS = register(Counter(
+    "chatbot_prompt_cached_tokens_total",
+    "Prompt tokens served from the upstream prompt cache, from the completion usage",
+))
+
+# Per-request timings (stage -> seconds), set only when a request asks for them
+_request_timings: ContextVar = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> dict:
+    """Start collecting stage timings for the current request and return the dict they go into"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_stage(stage: str, seconds: float):
+    """Record a stage duration in the histogram and in the current request's timings"""
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds, 6)
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as pipeline stage `stage`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def format_server_timing(timings: dict) -> str:
+    """Format request timings as a Server-Timing header value (durations in ms)"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
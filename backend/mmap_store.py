@@ -0,0 +1,244 @@
+"""Compact memory-mapped vector index for the (mostly static) knowledge base.
+
+An alternative to Chroma selected with VECTOR_BACKEND=mmap. Each index
+generation is a directory of flat files:
+
+    vectors.npy   (n, d) L2-normalized embeddings, float16 or int8
+    offsets.npy   (n + 1,) int64 byte offsets into records.bin
+    records.bin   concatenated UTF-8 JSON {"text", "metadata"} per row
+    meta.json     dtype, dimension and row count
+
+All three data files are opened with mmap, so loading takes milliseconds and
+every process on the host shares the same page-cache pages instead of holding
+its own copy. Search is exact cosine top-k by blocked matrix multiply, which
+stays fast up to a few hundred thousand chunks.
+
+Writes never modify a published generation: they write a new directory and
+atomically repoint CURRENT at it, so readers that still map the old files
+are unaffected until they reload.
+"""
+import json
+import os
+import shutil
+import logging
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+SEARCH_BLOCK_ROWS = 65536  # Rows scored per matmul; bounds temporary float32 memory
+INT8_SCALE = 127.0
+KEEP_GENERATIONS = 2  # Published generations kept on disk (current + previous)
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _quantize(vectors: np.ndarray, dtype: str) -> np.ndarray:
+    if dtype == "int8":
+        return np.clip(np.round(vectors * INT8_SCALE), -127, 127).astype(np.int8)
+    if dtype == "float16":
+        return vectors.astype(np.float16)
+    raise ValueError(f"Unsupported mmap index dtype: {dtype}")
+
+
+class MmapVectorStore:
+    """Read-mostly vector store with the subset of the LangChain VectorStore API RAGSystem uses"""
+
+    def __init__(self, directory: Path, embedding, dtype: str = "float16"):
+        self.directory = Path(directory)
+        self.embedding = embedding
+        self.dtype = dtype
+        self.generation_dir = None
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._records = np.zeros(0, dtype=np.uint8)
+        self._row_by_id = None
+        self._load()
+
+    @staticmethod
+    def exists(directory: Path) -> bool:
+        return (Path(directory) / CURRENT_FILE).exists()
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], embedding, persist_directory: Path, dtype: str = "float16"):
+        """Build a new generation containing exactly `documents`"""
+        store = cls(persist_directory, embedding, dtype=dtype)
+        vectors = embedding.embed_documents([doc.page_content for doc in documents]) if documents else []
+        store._publish(_normalize(vectors) if documents else np.zeros((0, 0), dtype=np.float32),
+                       [store._encode(doc) for doc in documents])
+        return store
+
+    def __len__(self):
+        return self._vectors.shape[0]
+
+    def _load(self):
+        current = self.directory / CURRENT_FILE
+        if not current.exists():
+            return
+        gen_dir = self.directory / current.read_text().strip()
+        meta = json.loads((gen_dir / "meta.json").read_text())
+        self.dtype = meta["dtype"]
+        # An empty generation has no arrays on disk; drop the previous generation's rows
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._records = np.zeros(0, dtype=np.uint8)
+        if meta["count"] > 0:
+            self._vectors = np.load(gen_dir / "vectors.npy", mmap_mode="r")
+            self._offsets = np.load(gen_dir / "offsets.npy", mmap_mode="r")
+            self._records = np.memmap(gen_dir / "records.bin", dtype=np.uint8, mode="r")
+        self.generation_dir = gen_dir
+        self._row_by_id = None
+
+    @staticmethod
+    def _encode(doc: Document) -> bytes:
+        return json.dumps({"text": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False).encode("utf-8")
+
+    def _document(self, row: int) -> Document:
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        record = json.loads(bytes(self._records[start:end]).decode("utf-8"))
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def _dequantized(self) -> np.ndarray:
+        vectors = np.asarray(self._vectors, dtype=np.float32)
+        return vectors / INT8_SCALE if self.dtype == "int8" else vectors
+
+    def _publish(self, vectors: np.ndarray, records: List[bytes]):
+        """Write a new generation directory and atomically make it current"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        generations = sorted(
+            (int(p.name[1:]) for p in self.directory.glob("v*") if p.is_dir() and p.name[1:].isdigit())
+        )
+        name = f"v{(generations[-1] + 1) if generations else 1}"
+        tmp_dir = self.directory / f".{name}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        if records:
+            offsets[1:] = np.cumsum([len(r) for r in records])
+        np.save(tmp_dir / "vectors.npy", _quantize(vectors, self.dtype))
+        np.save(tmp_dir / "offsets.npy", offsets)
+        with open(tmp_dir / "records.bin", "wb") as f:
+            for record in records:
+                f.write(record)
+        meta = {"dtype": self.dtype, "dimension": int(vectors.shape[1]) if vectors.size else 0, "count": len(records)}
+        (tmp_dir / "meta.json").write_text(json.dumps(meta))
+        os.replace(tmp_dir, self.directory / name)
+
+        current_tmp = self.directory / f"{CURRENT_FILE}.{os.getpid()}.tmp"
+        current_tmp.write_text(name)
+        os.replace(current_tmp, self.directory / CURRENT_FILE)
+
+        # Older generations may still be mapped by other processes; on POSIX the
+        # mapping stays valid after the files are unlinked
+        for old in generations[:-(KEEP_GENERATIONS - 1) or None]:
+            shutil.rmtree(self.directory / f"v{old}", ignore_errors=True)
+
+        self._load()
+        logger.info("Published mmap index generation", extra={'generation': name, 'count': len(records)})
+
+    def _rows_by_chunk_id(self) -> dict:
+        """chunk_id -> row, decoded from the records once per generation (writer side only)"""
+        if self._row_by_id is None:
+            self._row_by_id = {}
+            for row in range(len(self)):
+                chunk_id = self._document(row).metadata.get('chunk_id')
+                if chunk_id:
+                    self._row_by_id.setdefault(chunk_id, row)
+        return self._row_by_id
+
+    def existing_ids(self, ids) -> set:
+        """The subset of `ids` (chunk_id values) already in the index"""
+        rows = self._rows_by_chunk_id()
+        return {i for i in ids if i in rows}
+
+    def sync(self, documents: List[Document]):
+        """Publish a generation containing exactly `documents`, embedding only chunk_ids not already indexed"""
+        rows = self._rows_by_chunk_id()
+        missing = [doc for doc in documents if doc.metadata.get('chunk_id') not in rows]
+        new_vectors = _normalize(self.embedding.embed_documents([doc.page_content for doc in missing])) if missing else None
+        old_vectors = self._dequantized() if len(self) else None
+        dimension = new_vectors.shape[1] if new_vectors is not None else (old_vectors.shape[1] if old_vectors is not None else 0)
+
+        vectors = np.zeros((len(documents), dimension), dtype=np.float32)
+        next_new = 0
+        for i, doc in enumerate(documents):
+            row = rows.get(doc.metadata.get('chunk_id'))
+            if row is not None:
+                vectors[i] = old_vectors[row]
+            else:
+                vectors[i] = new_vectors[next_new]
+                next_new += 1
+        self._publish(vectors, [self._encode(doc) for doc in documents])
+        logger.info("Synced mmap index", extra={'reused': len(documents) - len(missing), 'embedded': len(missing)})
+
+    def replace_source(self, source: str, documents: List[Document]) -> int:
+        """Make `source`'s rows exactly `documents`, keeping every other source; returns how many rows were removed"""
+        wanted = {doc.metadata.get('chunk_id') for doc in documents}
+        kept, removed = [], 0
+        for row in range(len(self)):
+            doc = self._document(row)
+            if doc.metadata.get('source') != source:
+                kept.append(doc)
+            elif doc.metadata.get('chunk_id') not in wanted:
+                removed += 1
+        if removed or len(self.existing_ids(wanted)) < len(wanted):
+            self.sync(kept + documents)
+        return removed
+
+    def add_documents(self, documents: List[Document], ids: List[str] | None = None):
+        """Append documents by publishing a new generation (existing rows are copied).
+
+        `ids` is accepted for API compatibility; chunk IDs live in each document's metadata.
+        """
+        if not documents:
+            return
+        new_vectors = _normalize(self.embedding.embed_documents([doc.page_content for doc in documents]))
+        vectors = np.vstack([self._dequantized(), new_vectors]) if len(self) else new_vectors
+        existing = bytes(self._records)
+        records = [existing[int(self._offsets[i]):int(self._offsets[i + 1])] for i in range(len(self))]
+        self._publish(vectors, records + [self._encode(doc) for doc in documents])
+
+    def persist(self):
+        """Writes are durable as soon as they are published; kept for API compatibility"""
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k=k)
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vectors([embedding], k=k)[0]
+
+    def similarity_search_by_vectors(self, embeddings, k: int = 4) -> List[List[Document]]:
+        """Exact cosine top-k for a batch of query vectors"""
+        count = len(self)
+        if count == 0 or k <= 0 or len(embeddings) == 0:
+            return [[] for _ in embeddings]
+        k = min(k, count)
+        queries = _normalize(embeddings).T  # (d, m)
+
+        best_scores = best_rows = None
+        for start in range(0, count, SEARCH_BLOCK_ROWS):
+            block = np.asarray(self._vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores = block @ queries  # (b, m)
+            rows = np.broadcast_to(np.arange(start, start + block.shape[0])[:, None], scores.shape)
+            if best_scores is not None:
+                scores = np.vstack([best_scores, scores])
+                rows = np.vstack([best_rows, rows])
+            top = np.argpartition(-scores, k - 1, axis=0)[:k]
+            best_scores = np.take_along_axis(scores, top, axis=0)
+            best_rows = np.take_along_axis(rows, top, axis=0)
+
+        order = np.argsort(-best_scores, axis=0)
+        best_rows = np.take_along_axis(best_rows, order, axis=0)
+        return [[self._document(int(row)) for row in best_rows[:, j]] for j in range(best_rows.shape[1])]
@@ -1,60 +1,216 @@
 import os
+import time
+import logging
+import threading
 from typing import List
 from pathlib import Path
 import asyncio
-from config import KNOWLEDGE_BASE_PATH, VECTORSTORE_PATH, EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP, RETRIEVAL_K
+from config import (
+    KNOWLEDGE_BASE_PATH, VECTORSTORE_PATH, EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP, RETRIEVAL_K,
+    WORKER_ROLE, INDEXER_URL, INDEXER_WAIT_SECONDS, INDEX_RELOAD_INTERVAL, VECTOR_BACKEND, MMAP_INDEX_DTYPE,
+    MIN_TEXT_LAYER_CHARS, OCR_DPI, OCR_RETRY_DPI, OCR_MIN_CONFIDENCE, ARTICLE_LOOKUP_MAX_CHUNKS,
+)
 
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader, UnstructuredExcelLoader
 from langchain.schema import Document
+from metrics import span, CONTEXT_CHARS, ARTICLE_LOOKUPS
+from index_sync import read_generation, bump_generation, RemoteEmbeddings, IndexerClient
+from mmap_store import MmapVectorStore
+from chunker import DocumentChunker
+from article_index import ArticleIndex
 
-# Import vertical Japanese PDF handler
+logger = logging.getLogger(__name__)
+
+# Import OCR handler for pages without a text layer (scanned / vertical Japanese PDFs)
 try:
-    from vertical_japanese import extract_text_from_pdf as extract_vertical_pdf
+    from vertical_japanese import ocr_pdf_page
 except ImportError:
-    print("Warning: vertical_japanese module not found. Vertical Japanese PDFs may not be processed correctly.")
-    extract_vertical_pdf = None
+    logger.warning("vertical_japanese module not found; scanned PDF pages will not be OCR'd")
+    ocr_pdf_page = None
+
+def format_source_docs(docs: List[Document]) -> List[str]:
+    """Format knowledge base hits as numbered, source-labelled context blocks"""
+    parts = []
+    for i, doc in enumerate(docs, 1):
+        source = doc.metadata.get('source', 'Unknown')
+        page = doc.metadata.get('page', 'N/A')
+        parts.append(f"[出典 {i}: {Path(source).name} - ページ {page}]\n{doc.page_content}")
+    return parts
+
+def _dedupe(docs: List[Document]) -> List[Document]:
+    """Drop repeated hits, by chunk_id (or text for chunks indexed before chunk IDs existed)"""
+    seen, unique = set(), []
+    for doc in docs:
+        key = doc.metadata.get('chunk_id') or doc.page_content
+        if key not in seen:
+            seen.add(key)
+            unique.append(doc)
+    return unique
+
+
+def _search_by_vectors(store, query_vectors: List[List[float]], k: int) -> List[List[Document]]:
+    """Top-k per query vector; one batched matrix search when the store supports it (mmap)"""
+    search_batch = getattr(store, 'similarity_search_by_vectors', None)
+    if search_batch is not None:
+        return search_batch(query_vectors, k=k)
+    return [store.similarity_search_by_vector(vector, k=k) for vector in query_vectors]
+
+
+def _drop_chroma_client(path: Path):
+    # Chroma caches one client per path per process; drop it so a reopen sees new data
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient._identifer_to_system.pop(str(path), None)
+    except Exception:
+        pass
+
+
+def _excerpt_order(doc: Document):
+    page = doc.metadata.get('page')
+    return (Path(str(doc.metadata.get('source', ''))).name, page if isinstance(page, int) else -1,
+            doc.metadata.get('chunk_id', ''))
 
 class RAGSystem:
-    def __init__(self):
+    def __init__(self, persist_directory: Path | None = None, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                 role: str = WORKER_ROLE, vector_backend: str = VECTOR_BACKEND):
         self.embeddings = None
         self.vectorstore = None
         self.conversation_vectorstore = None
         self.knowledge_base_path = KNOWLEDGE_BASE_PATH
-        self.persist_directory = VECTORSTORE_PATH
+        self.persist_directory = Path(persist_directory) if persist_directory else VECTORSTORE_PATH
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        # Knowledge base store: "chroma" or "mmap" (conversations always use Chroma)
+        self.vector_backend = vector_backend
+        # In the "query" role this process never writes the index: writes and
+        # embeddings go to the indexer process (see index_sync.py)
+        self.role = role
+        self.generation = 0
+        self.conversation_generation = 0
+        self._last_generation_check = 0.0
+        self.indexer = IndexerClient(INDEXER_URL) if role == 'query' else None
+        self.article_index = ArticleIndex(self.persist_directory)
+        # Index writes run in worker threads (off the event loop); this serializes them
+        self._write_lock = threading.RLock()
         
-    async def initialize(self):
-        """Initialize or load the vector database"""
-        # Create embeddings
-        self.embeddings = HuggingFaceEmbeddings(
+    def create_embeddings(self):
+        """Create the embedding model used for indexing and queries"""
+        if self.role == 'query':
+            return RemoteEmbeddings(INDEXER_URL)
+        return HuggingFaceEmbeddings(
             model_name=EMBEDDING_MODEL,
             model_kwargs={'device': 'cpu'}
         )
+
+    @property
+    def _mmap_directory(self) -> Path:
+        return self.persist_directory / 'mmap'
+
+    def _kb_store_exists(self) -> bool:
+        if self.vector_backend == 'mmap':
+            return MmapVectorStore.exists(self._mmap_directory)
+        return self.persist_directory.exists() and len(list(self.persist_directory.iterdir())) > 0
+
+    def _open_kb_store(self):
+        """Open the persisted knowledge base store with the configured backend"""
+        if self.vector_backend == 'mmap':
+            return MmapVectorStore(self._mmap_directory, self.embeddings, dtype=MMAP_INDEX_DTYPE)
+        return Chroma(
+            persist_directory=str(self.persist_directory),
+            embedding_function=self.embeddings
+        )
+
+    def _build_kb_store(self, chunks: List[Document]):
+        """Embed `chunks` into a new knowledge base store with the configured backend"""
+        self.persist_directory.mkdir(parents=True, exist_ok=True)
+        if self.vector_backend == 'mmap':
+            return MmapVectorStore.from_documents(chunks, self.embeddings, self._mmap_directory, dtype=MMAP_INDEX_DTYPE)
+        return Chroma.from_documents(
+            documents=chunks,
+            embedding=self.embeddings,
+            ids=[chunk.metadata['chunk_id'] for chunk in chunks],
+            persist_directory=str(self.persist_directory)
+        )
+
+    def _sync_kb_store(self, chunks: List[Document]):
+        """Make the existing knowledge base store hold exactly `chunks`.
+
+        Chunks whose chunk_id is already indexed keep their stored embedding;
+        only new or changed chunks are embedded, and stale ones are removed.
+        """
+        store = self._open_kb_store()
+        if self.vector_backend == 'mmap':
+            store.sync(chunks)
+            return store
+        existing = set(store.get(include=[])['ids'])
+        wanted = {chunk.metadata['chunk_id'] for chunk in chunks}
+        stale = list(existing - wanted)
+        if stale:
+            store.delete(ids=stale)
+        self._add_chunks(store, chunks, existing=existing)
+        logger.info("Synced vector database", extra={'reused': len(existing & wanted), 'removed': len(stale)})
+        return store
+
+    def _add_chunks(self, store, chunks: List[Document], existing: set | None = None) -> int:
+        """Add chunks whose chunk_id is not already in `store`; returns how many were added"""
+        ids = [chunk.metadata['chunk_id'] for chunk in chunks]
+        if existing is None:
+            if hasattr(store, 'existing_ids'):
+                existing = store.existing_ids(ids)
+            else:
+                existing = set(store.get(ids=ids, include=[])['ids']) if ids else set()
+        new_chunks = [chunk for chunk in chunks if chunk.metadata['chunk_id'] not in existing]
+        if new_chunks:
+            store.add_documents(new_chunks, ids=[chunk.metadata['chunk_id'] for chunk in new_chunks])
+        return len(new_chunks)
+
+    def _replace_source_chunks(self, store, source: str, chunks: List[Document]):
+        """Make `source`'s chunks in `store` exactly `chunks`; returns (added, removed)"""
+        ids = [chunk.metadata['chunk_id'] for chunk in chunks]
+        if hasattr(store, 'replace_source'):
+            added = len(set(ids) - store.existing_ids(ids))
+            return added, store.replace_source(source, chunks)
+        stale = list(set(store.get(where={'source': source}, include=[])['ids']) - set(ids))
+        if stale:
+            store.delete(ids=stale)
+        return self._add_chunks(store, chunks), len(stale)
+
+    def _text_splitter(self):
+        return DocumentChunker(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+
+    async def initialize(self):
+        """Initialize or load the vector database"""
+        # Create embeddings
+        self.embeddings = self.create_embeddings()
+
+        if self.role == 'query':
+            # The indexer builds the stores on its own startup; wait for it, then open them
+            await self.indexer.wait_until_ready(INDEXER_WAIT_SECONDS)
+            self._open_stores()
+            return
         
         # Check if vectorstore exists
-        if self.persist_directory.exists() and len(list(self.persist_directory.iterdir())) > 0:
-            print("Loading existing vector database...")
-            self.vectorstore = Chroma(
-                persist_directory=str(self.persist_directory),
-                embedding_function=self.embeddings
-            )
+        if self._kb_store_exists():
+            logger.info("Loading existing vector database", extra={'path': str(self.persist_directory), 'backend': self.vector_backend})
+            self.vectorstore = self._open_kb_store()
+            self.article_index = ArticleIndex.load(self.persist_directory)
         else:
-            print("Creating new vector database...")
+            logger.info("Creating new vector database", extra={'path': str(self.persist_directory)})
             await self.create_vectorstore()
 
         # Initialize (or load) conversation vectorstore (separate namespace)
         try:
             conv_dir = Path(self.persist_directory) / 'conversations'
             if conv_dir.exists() and len(list(conv_dir.iterdir())) > 0:
-                print("Loading existing conversation vectorstore...")
+                logger.info("Loading existing conversation vectorstore")
                 self.conversation_vectorstore = Chroma(
                     persist_directory=str(conv_dir),
                     embedding_function=self.embeddings
                 )
             else:
-                print("Creating new conversation vectorstore (empty)...")
+                logger.info("Creating new conversation vectorstore (empty)")
                 conv_dir.mkdir(parents=True, exist_ok=True)
                 # create an empty Chroma instance
                 self.conversation_vectorstore = Chroma(
@@ -62,85 +218,130 @@ class RAGSystem:
                     embedding_function=self.embeddings
                 )
         except Exception as e:
-            print(f"Failed to initialize conversation vectorstore: {e}")
-    
-    def _load_vertical_pdf(self, pdf_path: Path) -> List[Document]:
-        """Load PDF with vertical Japanese text using OCR"""
-        if extract_vertical_pdf is None:
-            print(f"Warning: Vertical Japanese handler not available. Falling back to standard loader.")
-            loader = PyPDFLoader(str(pdf_path))
-            return loader.load()
-        
-        try:
-            print(f"Using vertical Japanese OCR for: {pdf_path.name}")
-            result = extract_vertical_pdf(str(pdf_path), lang="jpn_vert", clean_text=True)
-            
-            if result['success']:
-                # Create a Document for each page
-                docs = []
-                for page_num, page_text in enumerate(result['pages'], start=1):
-                    if page_text.strip():  # Only add non-empty pages
-                        doc = Document(
-                            page_content=page_text,
-                            metadata={
-                                'source': str(pdf_path),
-                                'page': page_num,
-                                'type': 'vertical_japanese',
-                                'total_pages': result['page_count']
-                            }
-                        )
-                        docs.append(doc)
-                return docs
-            else:
-                print(f"OCR failed for {pdf_path.name}: {result['error']}. Falling back to standard loader.")
-                loader = PyPDFLoader(str(pdf_path))
-                return loader.load()
-        except Exception as e:
-            print(f"Error in vertical PDF loading {pdf_path.name}: {e}. Falling back to standard loader.")
-            loader = PyPDFLoader(str(pdf_path))
-            return loader.load()
+            logger.error("Failed to initialize conversation vectorstore", extra={'error': str(e)})
+
+    def _open_stores(self):
+        """Open (or reopen) the persisted stores without creating or writing anything"""
+        self._open_kb()
+        self._open_conversations()
+        logger.info("Opened vector database", extra={
+            'role': self.role, 'generation': self.generation, 'conversation_generation': self.conversation_generation,
+        })
+
+    def _open_kb(self):
+        self.generation = read_generation(self.persist_directory)
+        if self.vector_backend != 'mmap':
+            _drop_chroma_client(self.persist_directory)
+        self.vectorstore = self._open_kb_store() if self._kb_store_exists() else None
+        self.article_index = ArticleIndex.load(self.persist_directory)
+
+    def _open_conversations(self):
+        self.conversation_generation = read_generation(self.persist_directory, 'conversations')
+        conv_dir = Path(self.persist_directory) / 'conversations'
+        _drop_chroma_client(conv_dir)
+        self.conversation_vectorstore = Chroma(
+            persist_directory=str(conv_dir),
+            embedding_function=self.embeddings
+        ) if conv_dir.exists() else None
+
+    def reload_if_stale(self) -> bool:
+        """Reopen whichever store the indexer has published a new generation of (query role only)"""
+        if self.role != 'query':
+            return False
+        now = time.monotonic()
+        if now - self._last_generation_check < INDEX_RELOAD_INTERVAL:
+            return False
+        self._last_generation_check = now
+        generation = read_generation(self.persist_directory)
+        conversation_generation = read_generation(self.persist_directory, 'conversations')
+        if generation == self.generation and conversation_generation == self.conversation_generation:
+            return False
+        with span("index_reload"):
+            if generation != self.generation:
+                logger.info("Index generation changed; reloading", extra={'old': self.generation, 'new': generation})
+                self._open_kb()
+            if conversation_generation != self.conversation_generation:
+                self._open_conversations()
+        return True
     
-    async def create_vectorstore(self):
-        """Create vector database from knowledge base files (including subdirectories)"""
+    def _load_pdf(self, pdf_path: Path) -> List[Document]:
+        """Load a PDF page by page: use the text layer where there is one, OCR the rest.
+
+        Only pages whose text layer is (nearly) empty are rendered and OCR'd; the
+        OCR language (jpn / jpn_vert) is picked per page from its layout, with
+        files under a "Vertical writing" folder assumed vertical when unclear.
+        """
+        pages = PyPDFLoader(str(pdf_path)).load()
+        rel_path = pdf_path.relative_to(self.knowledge_base_path) if self.knowledge_base_path in pdf_path.parents else pdf_path
+        vertical_hint = "Verticle writing" in str(rel_path) or "Vertical writing" in str(rel_path)
+
+        docs, ocr_pages, unreadable = [], 0, 0
+        for doc in pages:
+            doc.metadata['total_pages'] = len(pages)
+            if len("".join(doc.page_content.split())) >= MIN_TEXT_LAYER_CHARS:
+                doc.metadata['extraction'] = 'text_layer'
+                docs.append(doc)
+                continue
+            if ocr_pdf_page is None:
+                unreadable += 1
+                continue
+
+            # PyPDFLoader pages are 0-based; pdf2image pages are 1-based
+            result = ocr_pdf_page(
+                str(pdf_path), doc.metadata['page'] + 1, vertical_hint=vertical_hint, dpi=OCR_DPI,
+                retry_dpi=OCR_RETRY_DPI, min_confidence=OCR_MIN_CONFIDENCE, clean_text=True,
+            )
+            if not result['success']:
+                logger.warning("OCR failed for page", extra={'file': pdf_path.name, 'page': doc.metadata['page'], 'error': result['error']})
+                unreadable += 1
+                continue
+            ocr_pages += 1
+            if result['text'].strip():
+                doc.page_content = result['text']
+                doc.metadata['extraction'] = 'ocr'
+                doc.metadata['ocr_lang'] = result['lang']
+                doc.metadata['ocr_confidence'] = result['confidence']
+                doc.metadata['ocr_dpi'] = result['dpi']
+                doc.metadata['ocr_seconds'] = result['seconds']
+                docs.append(doc)
+
+        logger.info("Loaded PDF", extra={'file': pdf_path.name, 'pages': len(pages), 'ocr_pages': ocr_pages, 'unreadable_pages': unreadable})
+        return docs
+
+    def load_knowledge_base(self) -> List[Document]:
+        """Load every supported file in the knowledge base (including subdirectories)"""
         documents = []
         
         # Recursively find all PDF files in knowledge base and subdirectories
         pdf_files = list(self.knowledge_base_path.rglob("*.pdf"))
-        print(f"Found {len(pdf_files)} PDF files (including subdirectories)")
+        logger.info("Found PDF files (including subdirectories)", extra={'count': len(pdf_files)})
         
         for pdf_file in pdf_files:
             try:
-                # Get relative path from knowledge base
-                rel_path = pdf_file.relative_to(self.knowledge_base_path)
-                print(f"Loading: {rel_path}")
+                with span("index_file"):
+                    # Get relative path from knowledge base
+                    rel_path = pdf_file.relative_to(self.knowledge_base_path)
+                    logger.info("Loading file", extra={'file': str(rel_path)})
                 
-                # Check if PDF is in "Verticle writing" folder (note the typo in folder name)
-                if "Verticle writing" in str(rel_path) or "Vertical writing" in str(rel_path):
-                    # Use vertical Japanese handler
-                    docs = self._load_vertical_pdf(pdf_file)
-                    documents.extend(docs)
-                else:
-                    # Use standard PDF loader
-                    loader = PyPDFLoader(str(pdf_file))
-                    docs = loader.load()
-                    documents.extend(docs)
+                    documents.extend(self._load_pdf(pdf_file))
                     
             except Exception as e:
-                print(f"Error loading {pdf_file.name}: {e}")
+                logger.error("Error loading file", extra={'file': pdf_file.name, 'error': str(e)})
         
         # Recursively find all Excel files
         excel_files = list(self.knowledge_base_path.rglob("*.xlsx"))
-        print(f"Found {len(excel_files)} Excel files (including subdirectories)")
+        logger.info("Found Excel files (including subdirectories)", extra={'count': len(excel_files)})
         
         for excel_file in excel_files:
             try:
-                rel_path = excel_file.relative_to(self.knowledge_base_path)
-                print(f"Loading: {rel_path}")
-                loader = UnstructuredExcelLoader(str(excel_file), mode="elements")
-                docs = loader.load()
-                documents.extend(docs)
+                with span("index_file"):
+                    rel_path = excel_file.relative_to(self.knowledge_base_path)
+                    logger.info("Loading file", extra={'file': str(rel_path)})
+                    loader = UnstructuredExcelLoader(str(excel_file), mode="elements")
+                    docs = loader.load()
+                    documents.extend(docs)
             except Exception as e:
-                print(f"Error loading {excel_file.name}: {e}")
+                logger.error("Error loading file", extra={'file': excel_file.name, 'error': str(e)})
                 # Fallback: try to read Excel with pandas and convert to simple text
                 try:
                     import pandas as pd
@@ -152,38 +353,60 @@ class RAGSystem:
                             metadata={'source': str(excel_file), 'sheet': sheet_name}
                         )
                         documents.append(doc)
-                    print(f"Loaded {excel_file.name} via pandas fallback")
+                    logger.info("Loaded via pandas fallback", extra={'file': excel_file.name})
                 except Exception as e2:
-                    print(f"Pandas fallback failed for {excel_file.name}: {e2}")
-        
+                    logger.error("Pandas fallback failed", extra={'file': excel_file.name, 'error': str(e2)})
+
+        return documents
+
+    async def create_vectorstore(self, documents: List[Document] | None = None):
+        """Create vector database from knowledge base files (including subdirectories).
+
+        Pass `documents` to index an already-loaded corpus instead of reading it again.
+        """
+        if self.role == 'query':
+            try:
+                await self.indexer.rebuild()
+            except Exception as e:
+                logger.error("Indexer rebuild request failed", extra={'error': str(e)})
+            return
+        # PDF parsing, OCR and embedding block; keep them off the event loop
+        await asyncio.to_thread(self.rebuild_vectorstore, documents)
+
+    def rebuild_vectorstore(self, documents: List[Document] | None = None):
+        """Blocking body of create_vectorstore (runs in a worker thread)"""
+        with self._write_lock:
+            self._rebuild_vectorstore(documents)
+
+    def _rebuild_vectorstore(self, documents: List[Document] | None):
+        if documents is None:
+            documents = self.load_knowledge_base()
+
         if not documents:
-            print("Warning: No documents loaded from knowledge base")
+            logger.warning("No documents loaded from knowledge base")
             # Create empty vectorstore
-            self.vectorstore = Chroma(
-                persist_directory=str(self.persist_directory),
-                embedding_function=self.embeddings
-            )
+            self.persist_directory.mkdir(parents=True, exist_ok=True)
+            self.vectorstore = self._open_kb_store()
+            bump_generation(self.persist_directory)
             return
         
-        print(f"Total documents loaded: {len(documents)}")
+        logger.info("Documents loaded", extra={'count': len(documents)})
         
         # Split documents into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len,
-        )
+        text_splitter = self._text_splitter()
         chunks = text_splitter.split_documents(documents)
-        print(f"Created {len(chunks)} chunks")
+        logger.info("Created chunks", extra={'count': len(chunks)})
         
-        # Create vectorstore
-        self.persist_directory.mkdir(parents=True, exist_ok=True)
-        self.vectorstore = Chroma.from_documents(
-            documents=chunks,
-            embedding=self.embeddings,
-            persist_directory=str(self.persist_directory)
-        )
-        print("Vector database created and persisted!")
+        # Create vectorstore, or bring an existing one up to date reusing unchanged chunks
+        with span("index_write"):
+            if self._kb_store_exists():
+                self.vectorstore = self._sync_kb_store(chunks)
+            else:
+                self.vectorstore = self._build_kb_store(chunks)
+            self.article_index.rebuild(chunks)
+            self.article_index.save()
+        bump_generation(self.persist_directory)
+        logger.info("Vector database created and persisted")
         
         # Write a small manifest of sources for quick inspection
         try:
@@ -193,77 +416,83 @@ class RAGSystem:
             with open(manifest_path, 'w', encoding='utf-8') as mf:
                 json.dump(sorted(list(sources)), mf, ensure_ascii=False, indent=2)
         except Exception as e:
-            print(f"Failed to write sources manifest: {e}")
+            logger.error("Failed to write sources manifest", extra={'error': str(e)})
 
     async def add_documents_from_file(self, file_path: Path):
         """Incrementally add documents from a single file to the existing vectorstore.
 
         This tries to load the file (respecting vertical PDFs), split into chunks,
-        and add them to the current Chroma vectorstore. If the vectorstore doesn't
+        and add them to the current vectorstore. If the vectorstore doesn't
         exist yet, it will create it from the single file.
         """
+        if self.role == 'query':
+            try:
+                return await self.indexer.index_file(file_path)
+            except Exception as e:
+                logger.error("Indexer index_file request failed", extra={'file': str(file_path), 'error': str(e)})
+                return False
+        return await asyncio.to_thread(self.index_file, file_path)
+
+    def index_file(self, file_path: Path) -> bool:
+        """Blocking body of add_documents_from_file (runs in a worker thread)"""
+        with self._write_lock:
+            return self._index_file(Path(file_path))
+
+    def _index_file(self, file_path: Path) -> bool:
         try:
             # Load file into Documents list
-            if str(file_path).lower().endswith('.pdf'):
-                # Use vertical loader if appropriate
-                rel_path = file_path.relative_to(self.knowledge_base_path) if self.knowledge_base_path in file_path.parents else file_path
-                if "Verticle writing" in str(rel_path) or "Vertical writing" in str(rel_path):
-                    docs = self._load_vertical_pdf(file_path)
+            with span("index_file"):
+                if str(file_path).lower().endswith('.pdf'):
+                    docs = self._load_pdf(file_path)
+                elif str(file_path).lower().endswith('.xlsx') or str(file_path).lower().endswith('.xls'):
+                    try:
+                        loader = UnstructuredExcelLoader(str(file_path), mode="elements")
+                        docs = loader.load()
+                    except Exception:
+                        # pandas fallback
+                        import pandas as pd
+                        sheets = pd.read_excel(str(file_path), sheet_name=None)
+                        docs = []
+                        for sheet_name, df in sheets.items():
+                            text = df.fillna('').astype(str).to_csv(index=False)
+                            doc = Document(
+                                page_content=text,
+                                metadata={'source': str(file_path), 'sheet': sheet_name}
+                            )
+                            docs.append(doc)
                 else:
-                    loader = PyPDFLoader(str(file_path))
-                    docs = loader.load()
-            elif str(file_path).lower().endswith('.xlsx') or str(file_path).lower().endswith('.xls'):
-                try:
-                    loader = UnstructuredExcelLoader(str(file_path), mode="elements")
-                    docs = loader.load()
-                except Exception:
-                    # pandas fallback
-                    import pandas as pd
-                    sheets = pd.read_excel(str(file_path), sheet_name=None)
-                    docs = []
-                    for sheet_name, df in sheets.items():
-                        text = df.fillna('').astype(str).to_csv(index=False)
-                        doc = Document(
-                            page_content=text,
-                            metadata={'source': str(file_path), 'sheet': sheet_name}
-                        )
-                        docs.append(doc)
-            else:
-                # Unsupported type: return
-                print(f"Unsupported file type for incremental indexing: {file_path}")
-                return False
+                    # Unsupported type: return
+                    logger.warning("Unsupported file type for incremental indexing", extra={'file': str(file_path)})
+                    return False
 
             if not docs:
-                print(f"No documents extracted from {file_path}")
+                logger.warning("No documents extracted", extra={'file': str(file_path)})
                 return False
 
             # Split into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=CHUNK_SIZE,
-                chunk_overlap=CHUNK_OVERLAP,
-                length_function=len,
-            )
+            text_splitter = self._text_splitter()
             chunks = text_splitter.split_documents(docs)
 
             # If vectorstore doesn't exist, create it from these chunks
             if self.vectorstore is None:
-                print("Vectorstore not present; creating new vectorstore from uploaded file...")
-                self.persist_directory.mkdir(parents=True, exist_ok=True)
-                self.vectorstore = Chroma.from_documents(
-                    documents=chunks,
-                    embedding=self.embeddings,
-                    persist_directory=str(self.persist_directory)
-                )
+                logger.info("Vectorstore not present; creating new vectorstore from uploaded file")
+                with span("index_write"):
+                    self.vectorstore = self._build_kb_store(chunks)
             else:
-                print(f"Adding {len(chunks)} chunks to existing vectorstore...")
                 try:
-                    # LangChain vectorstore API: add_documents
-                    self.vectorstore.add_documents(chunks)
+                    # Chunks already indexed (same chunk_id) are skipped; the file's
+                    # chunks from an earlier upload that no longer exist are removed
+                    with span("index_write"):
+                        added, removed = self._replace_source_chunks(self.vectorstore, str(file_path), chunks)
+                    logger.info("Added chunks to existing vectorstore",
+                                extra={'count': added, 'skipped': len(chunks) - added, 'removed': removed})
                 except Exception as e:
-                    print(f"add_documents failed: {e} -- falling back to full rebuild")
+                    logger.error("add_documents failed; falling back to full rebuild", extra={'error': str(e)})
                     # On failure, rebuild entire vectorstore to ensure consistency
-                    await self.create_vectorstore()
+                    self._rebuild_vectorstore(None)
                     return True
+            self.article_index.update_sources(chunks)
+            self.article_index.save()
 
             # Update sources manifest
             try:
@@ -279,7 +508,7 @@ class RAGSystem:
                 with open(manifest_path, 'w', encoding='utf-8') as mf:
                     json.dump(existing, mf, ensure_ascii=False, indent=2)
             except Exception as e:
-                print(f"Failed to update sources manifest: {e}")
+                logger.error("Failed to update sources manifest", extra={'error': str(e)})
 
             # Try to persist if supported
             try:
@@ -289,47 +518,55 @@ class RAGSystem:
             except Exception:
                 pass
 
-            print(f"Incremental indexing complete for: {file_path.name}")
+            bump_generation(self.persist_directory)
+            logger.info("Incremental indexing complete", extra={'file': file_path.name})
             return True
         except Exception as e:
-            print(f"Error in incremental indexing {file_path.name}: {e}")
+            logger.error("Error in incremental indexing", extra={'file': file_path.name, 'error': str(e)})
             return False
 
-    async def add_conversation_turn(self, session_id: str, role: str, text: str):
-        """Add a single conversation turn (user or assistant) to the conversation vectorstore.
+    def write_conversation_texts(self, items: List[dict]) -> bool:
+        """Embed conversation snippets ({'session', 'role', 'text'[, 'id', 'created']}) into conversation memory.
 
-        session_id is stored in metadata so we can filter or retrieve per session.
+        The only write path into conversation memory: session maintenance
+        (session_store.run_maintenance) calls it from a worker thread.
         """
+        with self._write_lock:
+            return self._write_conversation_texts(items)
+
+    def _write_conversation_texts(self, items: List[dict]) -> bool:
         try:
             if not self.conversation_vectorstore:
-                print("Conversation vectorstore not initialized; skipping add_conversation_turn")
+                logger.warning("Conversation vectorstore not initialized; skipping write_conversation_texts")
                 return False
 
-            # Create a Document for the turn
+            # Create a Document per turn
             from datetime import datetime
-            doc = Document(
-                page_content=text,
-                metadata={
-                    'source': 'conversation',
-                    'session': session_id,
-                    'role': role,
-                    'timestamp': datetime.utcnow().isoformat()
-                }
-            )
+            docs = [
+                Document(
+                    page_content=item['text'],
+                    metadata={
+                        'source': 'conversation',
+                        'session': item['session'],
+                        'role': item['role'],
+                        'timestamp': (datetime.utcfromtimestamp(item['created']) if item.get('created') else datetime.utcnow()).isoformat(),
+                        # Session-store turn id, so compaction can remove the turns it folds into a summary
+                        **({'turn_id': item['id']} if item.get('id') is not None else {}),
+                    }
+                )
+                for item in items if item['text'].strip()
+            ]
 
             # Split into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=CHUNK_SIZE,
-                chunk_overlap=CHUNK_OVERLAP,
-                length_function=len,
-            )
-            chunks = text_splitter.split_documents([doc])
+            text_splitter = self._text_splitter()
+            chunks = text_splitter.split_documents(docs)
 
             # Add to conversation vectorstore
             try:
-                self.conversation_vectorstore.add_documents(chunks)
+                with span("conversation_write"):
+                    added = self._add_chunks(self.conversation_vectorstore, chunks)
             except Exception as e:
-                print(f"conversation_vectorstore.add_documents failed: {e}")
+                logger.error("conversation_vectorstore.add_documents failed", extra={'error': str(e)})
                 return False
 
             # Persist if available
@@ -340,56 +577,145 @@ class RAGSystem:
             except Exception:
                 pass
 
+            if added:
+                bump_generation(self.persist_directory, 'conversations')
             return True
         except Exception as e:
-            print(f"Error adding conversation turn: {e}")
+            logger.error("Error adding conversation turn", extra={'error': str(e)})
             return False
+
+    def delete_conversation_docs(self, session_id: str, role: str | None = None, turn_ids: List[int] | None = None) -> int:
+        """Remove a session's entries (optionally only one role, or only the given session-store turns)
+        from conversation memory; returns how many"""
+        if not self.conversation_vectorstore or turn_ids == []:
+            return 0
+        conditions = [{'session': session_id}]
+        if role is not None:
+            conditions.append({'role': role})
+        if turn_ids is not None:
+            conditions.append({'turn_id': {'$in': list(turn_ids)}})
+        where = conditions[0] if len(conditions) == 1 else {'$and': conditions}
+        try:
+            with self._write_lock:
+                collection = self.conversation_vectorstore._collection
+                ids = collection.get(where=where, include=[])['ids']
+                if ids:
+                    collection.delete(ids=ids)
+            if ids:
+                bump_generation(self.persist_directory, 'conversations')
+            return len(ids)
+        except Exception as e:
+            logger.error("Failed to delete conversation entries", extra={'session': session_id, 'error': str(e)})
+            return 0
+
     async def retrieve_context(self, query: str, k: int = RETRIEVAL_K) -> str:
         """Retrieve relevant context for a query"""
-        if self.vectorstore is None:
-            return ""
-        
+        contexts = await self.retrieve_contexts([query], k=k)
+        return contexts[0]
+
+    async def retrieve_contexts(self, queries: List[str], k: int = RETRIEVAL_K) -> List[str]:
+        """Retrieve context for several queries at once (see retrieve_documents)"""
+        contexts = []
+        for query, (docs, convo_docs, from_article_index) in zip(queries, await self.retrieve_documents(queries, k)):
+            if not from_article_index:
+                # Excerpts are ordered by source/page rather than by score, so queries that
+                # retrieve the same statute excerpts produce the same prompt prefix
+                docs = sorted(docs, key=_excerpt_order)
+            contexts.append(self._build_context(query, docs, convo_docs))
+        return contexts
+
+    async def retrieve_documents(self, queries: List[str], k: int = RETRIEVAL_K):
+        """Knowledge base and conversation documents for each query.
+
+        Returns one (docs, convo_docs, from_article_index) tuple per query.
+        Queries that name a statute article are answered from the article
+        index (docs in document order, no conversation search). The rest are
+        embedded in a single batched call, and the resulting vectors are reused
+        for both the knowledge base and conversation searches (docs in score order).
+        """
+        self.reload_if_stale()
+        if self.vectorstore is None or not queries:
+            return [([], [], False) for _ in queries]
+
+        results = [None] * len(queries)
+        with span("article_lookup"):
+            for i, query in enumerate(queries):
+                docs = self.article_index.lookup(query, ARTICLE_LOOKUP_MAX_CHUNKS)
+                if docs:
+                    results[i] = (docs, [], True)
+                ARTICLE_LOOKUPS.inc(1, "hit" if docs else "miss")
+
+        misses = [i for i, result in enumerate(results) if result is None]
+        if not misses:
+            return results
+        try:
+            with span("embed"):
+                query_vectors = await self._embed_queries([queries[i] for i in misses])
+        except Exception as e:
+            logger.error("Error embedding queries", extra={'error': str(e)})
+            return [result or ([], [], False) for result in results]
+
+        # The searches block (vector math, SQLite); run them all in one worker thread
+        for i, result in zip(misses, await asyncio.to_thread(self._search_all, query_vectors, k)):
+            results[i] = result
+        return results
+
+    async def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed without blocking the event loop (remote embeddings are awaited, local models run in a thread)"""
+        aembed_documents = getattr(self.embeddings, 'aembed_documents', None)
+        if aembed_documents is not None:
+            return await aembed_documents(texts)
+        return await asyncio.to_thread(self.embeddings.embed_documents, texts)
+
+    def _search_all(self, query_vectors: List[List[float]], k: int):
+        """Search both vectorstores with precomputed query vectors; (docs, convo_docs, False) per vector"""
         try:
             # Perform similarity search
-            docs = self.vectorstore.similarity_search(query, k=k)
-            
-            # Combine documents into context
-            context_parts = []
-            rag_sources = []
-            for i, doc in enumerate(docs, 1):
-                source = doc.metadata.get('source', 'Unknown')
-                page = doc.metadata.get('page', 'N/A')
-                rag_sources.append({'source': str(source), 'page': page, 'preview': doc.page_content[:200]})
-                context_parts.append(f"[出典 {i}: {Path(source).name} - ページ {page}]\n{doc.page_content}")
-
-            # Also retrieve conversation-based context (semantic matches from recent conversations)
+            with span("kb_search"):
+                kb_results = [_dedupe(docs) for docs in _search_by_vectors(self.vectorstore, query_vectors, k)]
+        except Exception as e:
+            logger.error("Error retrieving context", extra={'error': str(e)})
+            return [([], [], False) for _ in query_vectors]
+
+        # Also retrieve conversation-based context (semantic matches from recent conversations)
+        convo_results = [[] for _ in query_vectors]
+        try:
+            if self.conversation_vectorstore is not None:
+                with span("convo_search"):
+                    convo_results = [_dedupe(docs) for docs in
+                                     _search_by_vectors(self.conversation_vectorstore, query_vectors, k)]
+        except Exception as e:
+            logger.error("Error retrieving conversation context", extra={'error': str(e)})
+        return [(docs, convo_docs, False) for docs, convo_docs in zip(kb_results, convo_results)]
+
+    def _build_context(self, query: str, docs: List[Document], convo_docs: List[Document]) -> str:
+        """Format knowledge base excerpts (in the given order) and conversation snippets into one context"""
+        with span("context_build"):
+            context_parts = format_source_docs(docs)
+            rag_sources = [
+                {'source': str(doc.metadata.get('source', 'Unknown')), 'page': doc.metadata.get('page', 'N/A'), 'preview': doc.page_content[:200]}
+                for doc in docs
+            ]
+
             convo_parts = []
             convo_sources = []
-            try:
-                if self.conversation_vectorstore is not None:
-                    convo_docs = self.conversation_vectorstore.similarity_search(query, k=k)
-                    for j, cdoc in enumerate(convo_docs, 1):
-                        session = cdoc.metadata.get('session', 'unknown')
-                        role = cdoc.metadata.get('role', 'unknown')
-                        convo_sources.append({'session': session, 'role': role, 'preview': cdoc.page_content[:200]})
-                        convo_parts.append(f"[会話 ({role}) セッション:{session}]\n{cdoc.page_content}")
-            except Exception as e:
-                print(f"Error retrieving conversation context: {e}")
-
-            # Debug logging: print which sources were matched for this query
-            try:
-                print(f"retrieve_context: query=\"{query}\" -> {len(rag_sources)} RAG hits, {len(convo_sources)} convo hits")
-                if rag_sources:
-                    print("RAG hits (top):", rag_sources[:min(5, len(rag_sources))])
-                if convo_sources:
-                    print("Conversation hits (top):", convo_sources[:min(5, len(convo_sources))])
-            except Exception:
-                pass
+            for cdoc in convo_docs:
+                session = cdoc.metadata.get('session', 'unknown')
+                role = cdoc.metadata.get('role', 'unknown')
+                convo_sources.append({'session': session, 'role': role, 'preview': cdoc.page_content[:200]})
+                convo_parts.append(f"[会話 ({role}) セッション:{session}]\n{cdoc.page_content}")
 
             # Combine RAG docs first, then conversation snippets
-            all_parts = context_parts + convo_parts
-            return "\n\n".join(all_parts)
-        except Exception as e:
-            print(f"Error retrieving context: {e}")
-            return ""
+            context = "\n\n".join(context_parts + convo_parts)
+
+        # Debug logging: which sources were matched for this query
+        logger.debug("retrieve_context", extra={
+            'query': query,
+            'rag_hits': len(rag_sources),
+            'convo_hits': len(convo_sources),
+            'rag_top': rag_sources[:5],
+            'convo_top': convo_sources[:5],
+        })
 
+        CONTEXT_CHARS.observe(len(context))
+        return context
@@ -0,0 +1,234 @@
+"""Durable, append-only chat session log.
+
+Every turn is one INSERT into a SQLite database in WAL mode, so recording a
+turn no longer splits or embeds anything on the request path, and a
+session's ordered history is a single indexed query. Several worker
+processes can append to the same file concurrently.
+
+Conversation memory (the conversation vectorstore) is filled lazily by
+run_maintenance(), which the index-writing process runs periodically:
+- only salient turns are embedded (user questions of a minimum length;
+  long assistant answers are not);
+- turns older than the most recent `keep_recent` per session are folded
+  into one extractive summary per session, which is embedded in their place
+  (folded turns are removed from conversation memory);
+- sessions idle for longer than the TTL are deleted, together with their
+  conversation-memory entries.
+"""
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import List
+
+from config import (
+    SESSION_DB_PATH, SESSION_KEEP_RECENT_TURNS, SESSION_SUMMARY_MAX_CHARS, SESSION_SALIENT_MIN_CHARS, SESSION_TTL_DAYS,
+)
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# turns.embedded values
+PENDING, EMBEDDED, NOT_SALIENT = 0, 1, 2
+
+SUMMARY_TURN_CHARS = 200  # Characters kept from each turn folded into a summary
+ROLE_LABELS = {'user': 'ユーザー', 'assistant': 'アシスタント'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL,
+    embedded INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS turns_by_session ON turns (session, id);
+CREATE INDEX IF NOT EXISTS turns_pending ON turns (embedded) WHERE embedded = 0;
+CREATE TABLE IF NOT EXISTS summaries (
+    session TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    turns INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    embedded INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class SessionStore:
+    """Append-only session log with compaction and expiry"""
+
+    def __init__(self, path: Path | None = None, keep_recent: int = SESSION_KEEP_RECENT_TURNS,
+                 ttl_seconds: float = SESSION_TTL_DAYS * 86400, salient_min_chars: int = SESSION_SALIENT_MIN_CHARS,
+                 summary_max_chars: int = SESSION_SUMMARY_MAX_CHARS):
+        self.path = Path(path) if path else SESSION_DB_PATH
+        self.keep_recent = keep_recent
+        self.ttl_seconds = ttl_seconds
+        self.salient_min_chars = salient_min_chars
+        self.summary_max_chars = summary_max_chars
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # Durable across process crashes; fsync at checkpoints
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def is_salient(self, role: str, text: str) -> bool:
+        """Whether a turn is worth embedding for later recall"""
+        return role == 'user' and len(text.strip()) >= self.salient_min_chars
+
+    def append(self, session_id: str, role: str, text: str) -> int:
+        """Record one turn; returns its id"""
+        embedded = PENDING if self.is_salient(role, text) else NOT_SALIENT
+        with span("session_append"), self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO turns (session, role, text, created, embedded) VALUES (?, ?, ?, ?, ?)",
+                (session_id, role, text, time.time(), embedded),
+            )
+        return cursor.lastrowid
+
+    def history(self, session_id: str, limit: int | None = None) -> dict:
+        """Ordered turns of a session (the last `limit` if given) and the summary of compacted older turns"""
+        with self._lock:
+            summary = self._conn.execute(
+                "SELECT text, turns FROM summaries WHERE session = ?", (session_id,)
+            ).fetchone()
+            rows = self._conn.execute(
+                "SELECT id, role, text, created FROM turns WHERE session = ? ORDER BY id DESC LIMIT ?",
+                (session_id, -1 if limit is None else limit),
+            ).fetchall()
+        return {
+            'session_id': session_id,
+            'summary': summary[0] if summary else None,
+            'summarized_turns': summary[1] if summary else 0,
+            'turns': [{'id': r[0], 'role': r[1], 'text': r[2], 'created': r[3]} for r in reversed(rows)],
+        }
+
+    def pending_embeddings(self, limit: int = 256):
+        """Salient turns and summaries not yet in conversation memory"""
+        with self._lock:
+            turns = self._conn.execute(
+                "SELECT id, session, role, text, created FROM turns WHERE embedded = ? ORDER BY id LIMIT ?",
+                (PENDING, limit),
+            ).fetchall()
+            summaries = self._conn.execute(
+                "SELECT session, text, updated FROM summaries WHERE embedded = ?", (PENDING,)
+            ).fetchall()
+        return (
+            [{'id': r[0], 'session': r[1], 'role': r[2], 'text': r[3], 'created': r[4]} for r in turns],
+            [{'session': r[0], 'role': 'summary', 'text': r[1], 'created': r[2]} for r in summaries],
+        )
+
+    def mark_embedded(self, turn_ids: List[int], summaries: List[dict]):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE turns SET embedded = ? WHERE id = ?", [(EMBEDDED, i) for i in turn_ids])
+            # Only clear summaries that have not been rewritten since they were read
+            self._conn.executemany(
+                "UPDATE summaries SET embedded = ? WHERE session = ? AND updated = ?",
+                [(EMBEDDED, s['session'], s['created']) for s in summaries],
+            )
+
+    def compact(self) -> dict:
+        """Fold all but the most recent `keep_recent` turns of each session into its summary.
+
+        Returns {session: ids of folded turns that had been embedded} for every session
+        whose summary changed (its old summary and those turns are stale in conversation memory).
+        """
+        with self._lock:
+            sessions = [r[0] for r in self._conn.execute(
+                "SELECT session FROM turns GROUP BY session HAVING COUNT(*) > ?", (self.keep_recent,)
+            ).fetchall()]
+
+        compacted = {}
+        for session_id in sessions:
+            with self._lock, self._conn:
+                old = self._conn.execute(
+                    "SELECT id, role, text, embedded FROM turns WHERE session = ? ORDER BY id DESC LIMIT -1 OFFSET ?",
+                    (session_id, self.keep_recent),
+                ).fetchall()
+                if not old:
+                    continue
+                old.reverse()
+                previous = self._conn.execute(
+                    "SELECT text, turns FROM summaries WHERE session = ?", (session_id,)
+                ).fetchone()
+                lines = [previous[0]] if previous else []
+                for _, role, text, _ in old:
+                    snippet = " ".join(text.split())[:SUMMARY_TURN_CHARS]
+                    lines.append(f"{ROLE_LABELS.get(role, role)}: {snippet}")
+                # Keep the most recent part of the summary when it grows too long
+                summary = "\n".join(lines)[-self.summary_max_chars:]
+
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO summaries (session, text, turns, updated, embedded) VALUES (?, ?, ?, ?, ?)",
+                    (session_id, summary, (previous[1] if previous else 0) + len(old), time.time(), PENDING),
+                )
+                self._conn.execute(
+                    "DELETE FROM turns WHERE session = ? AND id <= ?", (session_id, old[-1][0])
+                )
+            compacted[session_id] = [turn_id for turn_id, _, _, embedded in old if embedded == EMBEDDED]
+        return compacted
+
+    def expire(self) -> List[str]:
+        """Delete sessions with no turn newer than the TTL; returns their ids"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock, self._conn:
+            expired = [r[0] for r in self._conn.execute(
+                """SELECT session FROM (
+                       SELECT session, MAX(created) AS last FROM turns GROUP BY session
+                       UNION ALL SELECT session, updated AS last FROM summaries
+                   ) GROUP BY session HAVING MAX(last) < ?""",
+                (cutoff,),
+            ).fetchall()]
+            for session_id in expired:
+                self._conn.execute("DELETE FROM turns WHERE session = ?", (session_id,))
+                self._conn.execute("DELETE FROM summaries WHERE session = ?", (session_id,))
+        return expired
+
+
+async def run_maintenance(store: SessionStore, rag) -> dict:
+    """Expire and compact sessions, then embed pending salient turns and summaries.
+
+    `rag` must be able to write the conversation vectorstore (standalone or indexer role).
+    The SQLite and vectorstore work blocks, so it runs in a worker thread.
+    """
+    return await asyncio.to_thread(_run_maintenance, store, rag)
+
+
+def _run_maintenance(store: SessionStore, rag) -> dict:
+    expired = store.expire()
+    for session_id in expired:
+        rag.delete_conversation_docs(session_id)
+
+    compacted = store.compact()
+    for session_id, folded_turn_ids in compacted.items():
+        # The new summary replaces both the old summary and the turns it now covers
+        rag.delete_conversation_docs(session_id, role='summary')
+        rag.delete_conversation_docs(session_id, turn_ids=folded_turn_ids)
+
+    turns, summaries = store.pending_embeddings()
+    embedded = 0
+    if turns or summaries:
+        if rag.write_conversation_texts(turns + summaries):
+            store.mark_embedded([t['id'] for t in turns], summaries)
+            embedded = len(turns) + len(summaries)
+
+    if expired or compacted or embedded:
+        logger.info("Session maintenance", extra={'expired': len(expired), 'compacted': len(compacted), 'embedded': embedded})
+    return {'expired': len(expired), 'compacted': len(compacted), 'embedded': embedded}
+
+
+async def maintenance_loop(store: SessionStore, rag, interval: float):
+    """Run run_maintenance every `interval` seconds until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_maintenance(store, rag)
+        except Exception as e:
+            logger.error("Session maintenance failed", extra={'error': str(e)})
@@ -1,10 +1,18 @@
 import pytesseract
 from PIL import Image
+import numpy as np
 import re
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+import io
 import os
 import sys
+import time
 import shutil
+import logging
+import subprocess
+from metrics import span
+
+logger = logging.getLogger(__name__)
 
 # Configure Tesseract path
 def _configure_tesseract():
@@ -25,23 +33,41 @@ def _configure_tesseract():
     for path in common_paths:
         if os.path.exists(path):
             pytesseract.pytesseract.tesseract_cmd = path
-            print(f"✓ Found Tesseract at: {path}")
+            logger.info("Found Tesseract", extra={'path': path})
             return True
     
-    print("WARNING: Tesseract OCR not found. Please install Tesseract:")
-    print("  Windows: https://github.com/UB-Mannheim/tesseract/wiki")
-    print("  macOS: brew install tesseract")
-    print("  Linux: sudo apt-get install tesseract-ocr")
+    logger.warning(
+        "Tesseract OCR not found. Please install Tesseract "
+        "(Windows: https://github.com/UB-Mannheim/tesseract/wiki, "
+        "macOS: brew install tesseract, Linux: sudo apt-get install tesseract-ocr)"
+    )
     return False
 
 # Try to configure Tesseract on module load
 _tesseract_available = _configure_tesseract()
 
 
+# A line-leading heading (第N条, 第N章, ...) or paragraph number followed by a
+# gap; the chunker only recognizes it with whitespace after it
+_HEADING_GAP_RE = re.compile(
+    r'^(第[0-9０-９〇一二三四五六七八九十百千]+(?:編|章|節|款|条)(?:の[0-9０-９〇一二三四五六七八九十百千]+)*'
+    r'|[0-9０-９]+(?=\s+[^\s0-9０-９]))\s+'
+)
+
+
+def _clean_line(line):
+    match = _HEADING_GAP_RE.match(line.strip())
+    if match:
+        return match.group(1) + "\u3000" + re.sub(r'\s+', '', line.strip()[match.end():])
+    return re.sub(r'\s+', '', line)
+
+
 def clean_japanese_text(text):
     """Clean and normalize Japanese OCR text"""
-    # Remove extra spaces between Japanese characters
-    text = re.sub(r'\s+', '', text)
+    # Remove extra spaces between Japanese characters, line by line: the chunker
+    # needs the line breaks (and the gap after a heading) to find 条/項 boundaries
+    lines = (_clean_line(line) for line in text.splitlines())
+    text = "\n".join(line for line in lines if line)
     
     # Normalize OCR misreads (optional custom fixes)
     text = text.replace("O", "〇")
@@ -49,7 +75,7 @@ def clean_japanese_text(text):
     return text
 
 
-def extract_text_from_pdf(pdf_path, lang="jpn_vert", dpi=300, clean_text=False, save_to_file=False):
+def extract_text_from_pdf(pdf_path, lang="jpn_vert", dpi=300, clean_text=False, save_to_file=False, adaptive=False):
     """
     Extract text from a PDF file using OCR.
     
@@ -59,6 +85,8 @@ def extract_text_from_pdf(pdf_path, lang="jpn_vert", dpi=300, clean_text=False,
         dpi (int): DPI resolution for PDF to image conversion (default: 300)
         clean_text (bool): Whether to clean/normalize the text (default: False)
         save_to_file (bool): Whether to save output to a text file (default: False)
+        adaptive (bool): OCR each page with ocr_pdf_page (preprocessed, lower first-pass
+            DPI, `dpi` only for low-confidence pages) instead of at `dpi` throughout
     
     Returns:
         dict: Dictionary containing:
@@ -68,6 +96,7 @@ def extract_text_from_pdf(pdf_path, lang="jpn_vert", dpi=300, clean_text=False,
             - 'page_count' (int): Number of pages processed
             - 'error' (str): Error message if any
             - 'output_file' (str): Path to saved file if save_to_file=True
+            - 'page_stats' (list): Per-page confidence, dpi and seconds (adaptive only)
     """
     # Check if Tesseract is available
     if not _tesseract_available:
@@ -81,24 +110,38 @@ def extract_text_from_pdf(pdf_path, lang="jpn_vert", dpi=300, clean_text=False,
         }
     
     try:
-        # Convert PDF pages to images
-        images = convert_from_path(pdf_path, dpi=dpi)
-        page_count = len(images)
-        
         # Process each page
         all_text = []
         pages_text = []
+        page_stats = []
         
-        for i, img in enumerate(images, start=1):
-            # OCR with specified language model
-            text = pytesseract.image_to_string(img, lang=lang, config="--psm 5")
-            
-            # Clean text if requested
-            if clean_text:
-                text = clean_japanese_text(text)
+        if adaptive:
+            page_count = pdfinfo_from_path(pdf_path)['Pages']
+            for i in range(1, page_count + 1):
+                result = ocr_pdf_page(pdf_path, i, lang=lang, dpi=min(ADAPTIVE_START_DPI, dpi), retry_dpi=dpi,
+                                      clean_text=clean_text)
+                if not result['success']:
+                    raise RuntimeError(result['error'])
+                pages_text.append(result['text'])
+                all_text.append(f"--- Page {i} ---\n{result['text']}\n")
+                page_stats.append({'page': i, 'confidence': result['confidence'], 'dpi': result['dpi'],
+                                   'seconds': result['seconds']})
+        else:
+            # Convert PDF pages to images
+            images = convert_from_path(pdf_path, dpi=dpi)
+            page_count = len(images)
             
-            pages_text.append(text)
-            all_text.append(f"--- Page {i} ---\n{text}\n")
+            for i, img in enumerate(images, start=1):
+                # OCR with specified language model
+                with span("ocr_page"):
+                    text = pytesseract.image_to_string(img, lang=lang, config="--psm 5")
+                
+                # Clean text if requested
+                if clean_text:
+                    text = clean_japanese_text(text)
+                
+                pages_text.append(text)
+                all_text.append(f"--- Page {i} ---\n{text}\n")
         
         # Combine all pages
         combined_text = "\n".join(all_text)
@@ -116,7 +159,8 @@ def extract_text_from_pdf(pdf_path, lang="jpn_vert", dpi=300, clean_text=False,
             'pages': pages_text,
             'page_count': page_count,
             'error': None,
-            'output_file': output_file
+            'output_file': output_file,
+            'page_stats': page_stats
         }
     
     except Exception as e:
@@ -130,6 +174,204 @@ def extract_text_from_pdf(pdf_path, lang="jpn_vert", dpi=300, clean_text=False,
         }
 
 
+def detect_vertical_layout(img):
+    """
+    Guess whether a page image is set in vertical (tategaki) or horizontal text.
+
+    Horizontal text leaves blank pixel rows between lines; vertical text leaves
+    blank pixel columns between columns. Compares the two within the inked area.
+
+    Returns:
+        bool | None: True for vertical, False for horizontal, None if unclear
+    """
+    ink = np.asarray(img.convert("L")) < 128
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    if len(rows) < 10 or len(cols) < 10:
+        return None
+    ink = ink[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+    # Rows/columns with almost no ink (specks, underlines) count as gaps
+    blank_rows = np.mean(ink.sum(axis=1) <= ink.shape[1] * 0.002)
+    blank_cols = np.mean(ink.sum(axis=0) <= ink.shape[0] * 0.002)
+    if blank_cols > blank_rows * 1.5 and blank_cols > 0.05:
+        return True
+    if blank_rows > blank_cols * 1.5 and blank_rows > 0.05:
+        return False
+    return None
+
+
+DESKEW_MAX_ANGLE = 3.0   # Largest skew (degrees) corrected by preprocess_page
+DESKEW_STEP = 0.25       # Angle resolution of the skew search
+DESKEW_WIDTH = 800       # Skew is estimated on a downscaled copy this wide
+ADAPTIVE_START_DPI = 200 # First-pass resolution of adaptive OCR
+
+
+def _otsu_threshold(gray):
+    """Gray level that best separates ink from paper (Otsu's method)"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    w0 = np.cumsum(hist)
+    w1 = gray.size - w0
+    sum0 = np.cumsum(hist * levels)
+    m0 = sum0 / np.where(w0 > 0, w0, 1)
+    m1 = (sum0[-1] - sum0) / np.where(w1 > 0, w1, 1)
+    between = w0 * w1 * (m0 - m1) ** 2
+    between[(w0 == 0) | (w1 == 0)] = 0
+    return int(np.argmax(between))
+
+
+def _estimate_skew(binary):
+    """Rotation (degrees, PIL convention) that makes text lines or columns straightest"""
+    ink = Image.fromarray(np.where(np.asarray(binary) < 128, 255, 0).astype(np.uint8))
+    if ink.width > DESKEW_WIDTH:
+        ink = ink.resize((DESKEW_WIDTH, max(1, ink.height * DESKEW_WIDTH // ink.width)))
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + DESKEW_STEP / 2, DESKEW_STEP):
+        rotated = np.asarray(ink.rotate(float(angle), fillcolor=0)) > 127
+        # Straight lines (or columns) give the most sharply peaked projection profile
+        score = max(np.var(rotated.sum(axis=1)), np.var(rotated.sum(axis=0)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess_page(img):
+    """
+    Prepare a page image for OCR: grayscale, binarize (Otsu) and deskew.
+
+    Returns:
+        PIL.Image: 1-bit image (black text on white)
+    """
+    gray = np.asarray(img.convert("L"))
+    binary = np.where(gray > _otsu_threshold(gray), 255, 0).astype(np.uint8)
+    angle = _estimate_skew(binary)
+    page = Image.fromarray(binary)
+    if abs(angle) >= DESKEW_STEP / 2:
+        page = page.rotate(angle, resample=Image.NEAREST, expand=True, fillcolor=255)
+    return page.convert("1")
+
+
+def _run_tesseract(img, lang, psm):
+    """
+    OCR an in-memory image, piping it to Tesseract's stdin (no temp image files).
+
+    Returns:
+        tuple: (text, mean word confidence 0-100, or 0.0 if no words were found)
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    proc = subprocess.run(
+        [pytesseract.pytesseract.tesseract_cmd, "stdin", "stdout", "-l", lang, "--psm", str(psm), "tsv"],
+        input=buffer.getvalue(), capture_output=True, check=True,
+    )
+
+    # TSV rows of level 5 are words; group them back into lines in reading order
+    lines, confidences = {}, []
+    for row in proc.stdout.decode("utf-8", errors="replace").splitlines()[1:]:
+        cols = row.split("\t")
+        if len(cols) < 12 or cols[0] != "5" or not cols[11].strip():
+            continue
+        confidence = float(cols[10])
+        if confidence < 0:
+            continue
+        confidences.append(confidence)
+        box = tuple(int(value) for value in cols[6:10])  # left, top, width, height
+        lines.setdefault((cols[2], cols[3], cols[4]), []).append((box, cols[11].strip()))
+
+    japanese = lang.startswith("jpn")
+    text = "\n".join(_join_words(words, japanese) for words in lines.values())
+    return text, (sum(confidences) / len(confidences) if confidences else 0.0)
+
+
+def _join_words(words, japanese):
+    """
+    Join the (box, text) words of one Tesseract line.
+
+    Japanese has no spaces between words, so they are concatenated; only a
+    visible gap of at least half a character (e.g. after a 条 heading) becomes
+    a full-width space. Other languages are joined with spaces.
+    """
+    if not japanese:
+        return " ".join(text for _, text in words)
+    parts = [words[0][1]]
+    for ((left, top, width, height), _), (box, text) in zip(words, words[1:]):
+        # Horizontal lines advance left to right, vertical (jpn_vert) lines top to bottom
+        gap = max(box[0] - (left + width), box[1] - (top + height))
+        if gap > 0.5 * min(width, height):
+            parts.append("\u3000")
+        parts.append(text)
+    return "".join(parts)
+
+
+def ocr_pdf_page(pdf_path, page_number, lang=None, vertical_hint=False, dpi=ADAPTIVE_START_DPI, retry_dpi=300,
+                 min_confidence=60, clean_text=False):
+    """
+    OCR a single PDF page adaptively.
+
+    The page is rendered in grayscale at `dpi`, binarized and deskewed, and
+    OCR'd; only if Tesseract's mean word confidence is below `min_confidence`
+    is it rendered again at `retry_dpi` and re-OCR'd (the better result wins).
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        page_number (int): 1-based page number
+        lang (str): Tesseract language model; None picks "jpn_vert" or "jpn" per page
+        vertical_hint (bool): Layout to assume when detection is inconclusive
+        dpi (int): First-pass DPI (default: 200)
+        retry_dpi (int): DPI for the low-confidence retry; 0 disables it (default: 300)
+        min_confidence (float): Mean word confidence (0-100) below which to retry (default: 60)
+        clean_text (bool): Whether to clean/normalize the text (default: False)
+
+    Returns:
+        dict: Dictionary containing:
+            - 'success' (bool): Whether extraction was successful
+            - 'text' (str): Extracted text
+            - 'lang' (str): Language model used
+            - 'confidence' (float): Mean Tesseract word confidence of the kept result
+            - 'dpi' (int): DPI of the kept result
+            - 'seconds' (float): Total render + OCR time for the page
+            - 'error' (str): Error message if any
+    """
+    start = time.perf_counter()
+    result = {'success': False, 'text': '', 'lang': lang, 'confidence': None, 'dpi': None, 'seconds': 0.0, 'error': None}
+    if not _tesseract_available:
+        result['error'] = 'Tesseract OCR is not installed or not found in PATH'
+        return result
+
+    try:
+        for pass_dpi in (dpi, retry_dpi):
+            if not pass_dpi or (result['dpi'] is not None and pass_dpi <= result['dpi']):
+                continue
+            images = convert_from_path(pdf_path, dpi=pass_dpi, first_page=page_number, last_page=page_number, grayscale=True)
+            if not images:
+                result['error'] = f'Page {page_number} could not be rendered'
+                break
+            page = preprocess_page(images[0])
+
+            if lang is None:
+                vertical = detect_vertical_layout(page)
+                lang = "jpn_vert" if (vertical_hint if vertical is None else vertical) else "jpn"
+
+            with span("ocr_page"):
+                text, confidence = _run_tesseract(page, lang, psm=5 if lang == "jpn_vert" else 3)
+
+            if result['confidence'] is None or confidence > result['confidence']:
+                result.update(success=True, text=text, lang=lang, confidence=round(confidence, 1), dpi=pass_dpi, error=None)
+            if confidence >= min_confidence:
+                break
+            logger.debug("Low OCR confidence", extra={'file': os.path.basename(str(pdf_path)), 'page': page_number,
+                                                      'dpi': pass_dpi, 'confidence': round(confidence, 1)})
+    except Exception as e:
+        result['error'] = str(e)
+
+    if result['success'] and clean_text:
+        result['text'] = clean_japanese_text(result['text'])
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
 def extract_text_from_image(image_path, lang="jpn_vert", clean_text=False):
     """
     Extract text from a single image file using OCR.
@@ -0,0 +1,219 @@
+"""Retrieval quality vs. latency sweep over chunking and k settings.
+
+Reads a JSONL evaluation file where each line is
+    {"question": "...", "expected": [{"source": "建築基準法.pdf", "page": 12}, ...]}
+("page" is optional, 1-based as printed in the PDF viewer) and, for every
+combination of --chunk-sizes x --chunk-overlaps x --k, reports recall@k,
+MRR, retrieval latency and average context size. The corpus is loaded once;
+each chunking setting gets its own scratch index.
+
+Questions go through RAGSystem.retrieve_documents, the path /chat uses:
+questions naming a statute article are answered by the article index and
+counted in "article_lookups"; the rest are embedded and searched. A page
+target matches a chunk that starts on or spans that page.
+
+Example:
+    python benchmarks/evaluate_retrieval.py --chunk-sizes 500,1000 --k 2,4,8 --min-recall 0.9
+
+The "recommended" entry in the output is the fastest setting (by p95
+latency, then context tokens) whose recall@k meets --min-recall.
+"""
+import argparse
+import asyncio
+import json
+import shutil
+import sys
+import tempfile
+import time
+import unicodedata
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from run_benchmarks import DEFAULT_CORPUS, count_chunks, percentiles, setup_environment
+
+DEFAULT_EVAL_FILE = Path(__file__).resolve().parent / "retrieval_eval.jsonl"
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Token count with the GPT-4o tokenizer if tiktoken is installed, else a chars-based estimate"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # Japanese text is roughly one token per character for GPT-4o
+    return len(text)
+
+
+def _normalize(name: str) -> str:
+    return unicodedata.normalize("NFC", Path(name).name)
+
+
+def _page_number(metadata) -> int | None:
+    """1-based page number of a chunk (PDF pages are 0-based; legacy vertical_japanese OCR pages were 1-based)"""
+    page = metadata.get('page')
+    if not isinstance(page, int):
+        return None
+    return page if metadata.get('type') == 'vertical_japanese' else page + 1
+
+
+def _matches(metadata, target) -> bool:
+    if _normalize(str(metadata.get('source', ''))) != _normalize(target['source']):
+        return False
+    if target.get('page') is None:
+        return True
+    first = _page_number(metadata)
+    if first is None:
+        return False
+    # Chunks spanning pages record the last one in page_end (same numbering as page)
+    last = first + (metadata['page_end'] - metadata['page']) if isinstance(metadata.get('page_end'), int) else first
+    return first <= target['page'] <= last
+
+
+def load_eval_set(path: Path):
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                items.append(json.loads(line))
+    return items
+
+
+def score(items, hits_per_question, k):
+    """Mean recall@k (fraction of expected targets found) and MRR within the top k"""
+    recalls, reciprocal_ranks = [], []
+    for item, hits in zip(items, hits_per_question):
+        top = hits[:k]
+        targets = item['expected']
+        found = sum(1 for t in targets if any(_matches(doc.metadata, t) for doc in top))
+        recalls.append(found / len(targets))
+        rank = next((i for i, doc in enumerate(top, 1) if any(_matches(doc.metadata, t) for t in targets)), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return sum(recalls) / len(recalls), sum(reciprocal_ranks) / len(reciprocal_ranks)
+
+
+async def evaluate(args):
+    from rag_system import RAGSystem, format_source_docs
+
+    items = load_eval_set(Path(args.eval_file))
+    questions = [item['question'] for item in items]
+    workdir = Path(args.workdir)
+
+    loader = RAGSystem()
+    documents = loader.load_knowledge_base()
+    embeddings = loader.create_embeddings()
+
+    rows = []
+    for chunk_size in args.chunk_sizes:
+        for chunk_overlap in args.chunk_overlaps:
+            if chunk_overlap >= chunk_size:
+                continue
+            index_dir = workdir / f"cs{chunk_size}_ov{chunk_overlap}"
+            shutil.rmtree(index_dir, ignore_errors=True)
+            rag = RAGSystem(
+                persist_directory=index_dir,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+            )
+            rag.embeddings = embeddings
+            start = time.perf_counter()
+            await rag.create_vectorstore(documents)
+            index_seconds = time.perf_counter() - start
+            chunk_count = count_chunks(rag.vectorstore)
+
+            for k in args.k:
+                hits, latencies, context_tokens, lookups = [], [], [], 0
+                for question in questions:
+                    start = time.perf_counter()
+                    docs, _, from_article_index = (await rag.retrieve_documents([question], k=k))[0]
+                    latencies.append(time.perf_counter() - start)
+                    hits.append(docs)
+                    lookups += from_article_index
+                    context_tokens.append(count_tokens("\n\n".join(format_source_docs(docs))))
+                recall, mrr = score(items, hits, k)
+                rows.append({
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": chunk_overlap,
+                    "k": k,
+                    "chunks": chunk_count,
+                    "index_seconds": round(index_seconds, 3),
+                    "recall_at_k": round(recall, 4),
+                    "mrr": round(mrr, 4),
+                    "article_lookups": lookups,
+                    "latency_seconds": percentiles(latencies),
+                    "avg_context_tokens": round(sum(context_tokens) / len(context_tokens), 1),
+                })
+
+    passing = [r for r in rows if r["recall_at_k"] >= args.min_recall]
+    recommended = min(
+        passing, key=lambda r: (r["latency_seconds"]["p95"], r["avg_context_tokens"]), default=None
+    )
+    return {
+        "eval_file": str(args.eval_file),
+        "questions": len(items),
+        "min_recall": args.min_recall,
+        "token_counter": "tiktoken:o200k_base" if _encoding is not None else "chars",
+        "results": rows,
+        "recommended": recommended,
+    }
+
+
+def _format_table(report) -> str:
+    header = f"{'size':>6} {'overlap':>7} {'k':>3} {'chunks':>7} {'recall':>7} {'mrr':>6} {'lookup':>6} {'p50 ms':>8} {'p95 ms':>8} {'ctx tok':>8}"
+    lines = [header, "-" * len(header)]
+    for r in report["results"]:
+        lat = r["latency_seconds"]
+        lines.append(
+            f"{r['chunk_size']:>6} {r['chunk_overlap']:>7} {r['k']:>3} {r['chunks']:>7} "
+            f"{r['recall_at_k']:>7.3f} {r['mrr']:>6.3f} {r['article_lookups']:>6} {lat['p50'] * 1000:>8.1f} {lat['p95'] * 1000:>8.1f} "
+            f"{r['avg_context_tokens']:>8.0f}"
+        )
+    best = report["recommended"]
+    if best:
+        lines.append(
+            f"\nRecommended: CHUNK_SIZE={best['chunk_size']} CHUNK_OVERLAP={best['chunk_overlap']} "
+            f"RETRIEVAL_K={best['k']} (recall@k {best['recall_at_k']:.3f})"
+        )
+    else:
+        lines.append(f"\nNo setting reaches recall@k >= {report['min_recall']}")
+    return "\n".join(lines)
+
+
+def _int_list(value: str):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep chunking and k settings for retrieval quality and latency")
+    parser.add_argument("--eval-file", default=str(DEFAULT_EVAL_FILE), help="JSONL question -> expected source/page file")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS), help="Knowledge base directory to index")
+    parser.add_argument("--chunk-sizes", type=_int_list, default=[500, 1000, 1500])
+    parser.add_argument("--chunk-overlaps", type=_int_list, default=[100, 200])
+    parser.add_argument("--k", type=_int_list, default=[2, 4, 6, 8])
+    parser.add_argument("--min-recall", type=float, default=0.9, help="Quality bar for the recommendation")
+    parser.add_argument("--embeddings", choices=("hf", "hash"), default="hf",
+                        help="hf: configured sentence-transformers model (must be cached); hash: no model")
+    parser.add_argument("--workdir", help="Scratch directory for the indexes (default: a temp dir)")
+    parser.add_argument("--format", choices=("table", "json"), default="table")
+    parser.add_argument("--output", help="Write the report here instead of stdout")
+    args = parser.parse_args()
+
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix="chatbot-eval-")
+    Path(args.workdir).mkdir(parents=True, exist_ok=True)
+    setup_environment(args, Path(args.workdir))
+
+    report = asyncio.run(evaluate(args))
+    text = _format_table(report) if args.format == "table" else json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Minimal OpenAI-compatible chat completions server for offline benchmarks.
+
+Implements POST /v1/chat/completions (streaming and non-streaming) with a
+configurable time-to-first-token and per-token delay, so /chat can be
+load-tested without network access or API cost. Usage reports cached prompt
+tokens the way OpenAI's automatic prompt caching does (prefix shared with an
+earlier prompt, from 1024 tokens in 128-token steps), counting one character
+as one token.
+
+Run standalone:
+    python benchmarks/mock_openai.py --port 8765
+and point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# A short Japanese answer, repeated to reach the requested token count
+_ANSWER_TOKENS = list("建築基準法に基づき、建築物の敷地、構造、設備及び用途に関する最低の基準を定めています。")
+
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT = 128
+CACHE_RECENT_PROMPTS = 256  # Earlier prompts compared against for a shared prefix
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def create_app(ttft: float = 0.2, token_delay: float = 0.01, tokens: int = 200) -> FastAPI:
+    """Build the mock app. Delays are in seconds."""
+    app = FastAPI(title="Mock OpenAI")
+    recent_prompts = []
+
+    def _usage(prompt: str) -> dict:
+        shared = max((_common_prefix(prompt, p) for p in recent_prompts), default=0)
+        cached = (shared // CACHE_INCREMENT) * CACHE_INCREMENT if shared >= CACHE_MIN_TOKENS else 0
+        recent_prompts.append(prompt)
+        del recent_prompts[:-CACHE_RECENT_PROMPTS]
+        return {
+            "prompt_tokens": len(prompt),
+            "completion_tokens": tokens,
+            "total_tokens": len(prompt) + tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+    def _answer_tokens():
+        return [_ANSWER_TOKENS[i % len(_ANSWER_TOKENS)] for i in range(tokens)]
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+
+        if body.get("stream"):
+            async def event_stream():
+                await asyncio.sleep(ttft)
+                for token in _answer_tokens():
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    if token_delay:
+                        await asyncio.sleep(token_delay)
+                final = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                }
+                yield f"data: {json.dumps(final)}\n\n"
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    usage_chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [],
+                        "usage": _usage(prompt),
+                    }
+                    yield f"data: {json.dumps(usage_chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+        await asyncio.sleep(ttft + token_delay * tokens)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(_answer_tokens())},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(prompt),
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat completions server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens per answer")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.ttft, args.token_delay, args.tokens), host="127.0.0.1", port=args.port)
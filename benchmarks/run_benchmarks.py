@@ -0,0 +1,421 @@
+"""Offline benchmark suite for indexing, retrieval, OCR and end-to-end chat.
+
+Runs against the bundled "knowledge base main" corpus (or --corpus) and a
+mocked OpenAI server, so it needs no GPU, network access or API key.
+Results are emitted as JSON; pass --compare with an earlier result file to
+get per-metric changes between commits.
+
+Examples:
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --only retrieval,chat --embeddings hash
+    python benchmarks/run_benchmarks.py --compare baseline.json --output bench.json
+
+With --embeddings hf (default) the sentence-transformers model must already
+be in the local Hugging Face cache; use --embeddings hash on a box without it.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = REPO_ROOT / "backend"
+DEFAULT_CORPUS = REPO_ROOT / "knowledge base main"
+SECTIONS = ("index", "retrieval", "ocr", "chat")
+
+# Representative questions for the bundled statutes
+QUERIES = [
+    "建築基準法第20条とは",
+    "建築確認申請が必要な建築物は何ですか",
+    "消防法の目的を教えてください",
+    "防火対象物の定義は",
+    "都市計画法における市街化調整区域とは",
+    "開発許可が必要な開発行為の規模は",
+    "一級建築士の業務独占の範囲は",
+    "建築士事務所の登録について教えてください",
+    "建ぺい率と容積率の違いは",
+    "用途地域の種類を教えてください",
+    "現場整備で注意すべき点は",
+    "工事工程表の作成方法は",
+]
+
+
+class HashEmbeddings:
+    """Deterministic character-bigram hashing embeddings (no model download)."""
+
+    def __init__(self, dim: int = 384, **kwargs):
+        self.dim = dim
+
+    def _embed(self, text: str):
+        vec = [0.0] * self.dim
+        for i in range(max(len(text) - 1, 1)):
+            digest = hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=4).digest()
+            vec[int.from_bytes(digest, "little") % self.dim] += 1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def percentiles(samples):
+    """Summarize latency samples (seconds) as p50/p95/p99/mean/min/max"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        rank = (len(ordered) - 1) * p / 100
+        lo, hi = math.floor(rank), math.ceil(rank)
+        return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
+
+    return {
+        "count": len(ordered),
+        "p50": round(pct(50), 6),
+        "p95": round(pct(95), 6),
+        "p99": round(pct(99), 6),
+        "mean": round(sum(ordered) / len(ordered), 6),
+        "min": round(ordered[0], 6),
+        "max": round(ordered[-1], 6),
+    }
+
+
+def count_chunks(vectorstore) -> int:
+    """Number of chunks in a knowledge base store (mmap or Chroma)"""
+    if vectorstore is None:
+        return 0
+    if hasattr(vectorstore, "__len__"):
+        return len(vectorstore)
+    return vectorstore._collection.count()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _start_server(app, port: int, timeout: float):
+    """Run a uvicorn server for `app` in a background thread and wait until it is up"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError(f"Server on port {port} failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def setup_environment(args, workdir: Path):
+    """Point the backend at the benchmark corpus, a scratch index and the mock OpenAI server.
+
+    Must run before any backend module is imported, since config.py reads
+    these variables at import time.
+    """
+    args.mock_port = _free_port()
+    os.environ["KNOWLEDGE_BASE_PATH"] = str(Path(args.corpus).resolve())
+    os.environ["VECTORSTORE_PATH"] = str(workdir / "vectorstore")
+    os.environ["SESSION_DB_PATH"] = str(workdir / "sessions.db")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.mock_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    # The load generator is one client without session_ids and measures capacity:
+    # no per-session rate limit, and a chat pool that admits every in-flight request
+    max_concurrency = max(getattr(args, "concurrency", None) or [1])
+    os.environ.setdefault("SESSION_RATE_PER_MINUTE", "0")
+    os.environ.setdefault("CHAT_MAX_CONCURRENCY", str(max(max_concurrency, 16)))
+    os.environ.setdefault("CHAT_MAX_QUEUE", str(max(max_concurrency, 64)))
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    if args.embeddings == "hash":
+        import rag_system
+        rag_system.HuggingFaceEmbeddings = HashEmbeddings
+
+
+async def bench_index(args):
+    """Cold build of the index from the corpus, then a warm load of the persisted index"""
+    from rag_system import RAGSystem
+
+    corpus = Path(args.corpus)
+    files = list(corpus.rglob("*.pdf")) + list(corpus.rglob("*.xlsx"))
+
+    rag = RAGSystem()
+    start = time.perf_counter()
+    await rag.initialize()
+    build_seconds = time.perf_counter() - start
+    chunks = count_chunks(rag.vectorstore)
+
+    reloaded = RAGSystem()
+    start = time.perf_counter()
+    await reloaded.initialize()
+    load_seconds = time.perf_counter() - start
+
+    return rag, {
+        "files": len(files),
+        "chunks": chunks,
+        "build_seconds": round(build_seconds, 3),
+        "files_per_second": round(len(files) / build_seconds, 3) if build_seconds else None,
+        "chunks_per_second": round(chunks / build_seconds, 3) if build_seconds else None,
+        "load_seconds": round(load_seconds, 3),
+    }
+
+
+def bench_retrieval(rag, args):
+    """retrieve_context latency at several concurrency levels (one thread per in-flight query)"""
+    def one_query(query):
+        start = time.perf_counter()
+        asyncio.run(rag.retrieve_context(query))
+        return time.perf_counter() - start
+
+    # Warm up the embedding model and the store
+    one_query(QUERIES[0])
+
+    results = {}
+    for concurrency in args.concurrency:
+        queries = [QUERIES[i % len(QUERIES)] for i in range(args.retrieval_queries)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(one_query, queries))
+        wall = time.perf_counter() - start
+        results[f"c{concurrency}"] = {
+            "latency_seconds": percentiles(samples),
+            "queries_per_second": round(len(samples) / wall, 3),
+        }
+    return results
+
+
+def bench_ocr(args):
+    """OCR pages/s of vertical_japanese.extract_text_from_pdf on the smallest corpus PDFs"""
+    import vertical_japanese
+
+    if not vertical_japanese._tesseract_available:
+        return {"skipped": "Tesseract OCR is not installed"}
+
+    pdfs = sorted(Path(args.corpus).rglob("*.pdf"), key=lambda p: p.stat().st_size)[:args.ocr_files]
+    pages, page_stats = 0, []
+    start = time.perf_counter()
+    for pdf in pdfs:
+        result = vertical_japanese.extract_text_from_pdf(str(pdf), lang=args.ocr_lang, clean_text=True,
+                                                         adaptive=args.ocr_adaptive)
+        if not result['success']:
+            return {"skipped": result['error']}
+        pages += result['page_count']
+        page_stats.extend(result['page_stats'])
+    elapsed = time.perf_counter() - start
+    report = {
+        "files": len(pdfs),
+        "pages": pages,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(pages / elapsed, 3) if elapsed else None,
+        "adaptive": args.ocr_adaptive,
+    }
+    if page_stats:
+        report["mean_confidence"] = round(sum(p['confidence'] for p in page_stats) / len(page_stats), 1)
+        report["pages_at_dpi"] = {str(dpi): sum(1 for p in page_stats if p['dpi'] == dpi)
+                                  for dpi in sorted({p['dpi'] for p in page_stats})}
+    return report
+
+
+async def _chat_load(base_url: str, concurrency: int, total: int):
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    ttfts, latencies, chars = [], [], []
+
+    async def one_chat(client, query):
+        async with semaphore:
+            start = time.perf_counter()
+            first = None
+            received = 0
+            async with client.stream("POST", f"{base_url}/chat", json={"query": query, "stream": True}) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+                    text = json.loads(line[6:]).get("text")
+                    if text:
+                        if first is None:
+                            first = time.perf_counter() - start
+                        received += len(text)
+            latencies.append(time.perf_counter() - start)
+            if first is not None:
+                ttfts.append(first)
+            chars.append(received)
+
+    async with httpx.AsyncClient(timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one_chat(client, QUERIES[i % len(QUERIES)]) for i in range(total)))
+        wall = time.perf_counter() - start
+
+    return {
+        "ttft_seconds": percentiles(ttfts),
+        "latency_seconds": percentiles(latencies),
+        "requests_per_second": round(total / wall, 3),
+        "chars_per_second": round(sum(chars) / wall, 3),
+    }
+
+
+def bench_chat(args):
+    """/chat TTFT and throughput through the real app against the mock OpenAI server"""
+    import importlib
+    from mock_openai import create_app
+
+    backend_main = importlib.import_module("main")
+    mock_server, _ = _start_server(
+        create_app(args.mock_ttft, args.mock_token_delay, args.mock_tokens), args.mock_port, timeout=30
+    )
+    app_port = _free_port()
+    app_server, _ = _start_server(backend_main.app, app_port, timeout=args.startup_timeout)
+    try:
+        base_url = f"http://127.0.0.1:{app_port}"
+        results = {
+            "mock": {"ttft": args.mock_ttft, "token_delay": args.mock_token_delay, "tokens": args.mock_tokens},
+        }
+        for concurrency in args.concurrency:
+            results[f"c{concurrency}"] = asyncio.run(_chat_load(base_url, concurrency, args.chat_requests))
+
+        from metrics import PROMPT_TOKENS, PROMPT_CACHED_TOKENS
+        prompt_tokens = PROMPT_TOKENS.get()
+        results["prompt_cache"] = {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": PROMPT_CACHED_TOKENS.get(),
+            "cached_ratio": round(PROMPT_CACHED_TOKENS.get() / prompt_tokens, 4) if prompt_tokens else None,
+        }
+        return results
+    finally:
+        app_server.should_exit = True
+        mock_server.should_exit = True
+
+
+def _flatten(data, prefix=""):
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(current, baseline):
+    """Per-metric change between two result files (percent, relative to baseline)"""
+    cur, base = _flatten(current["results"]), _flatten(baseline.get("results", {}))
+    changes = {}
+    for key in sorted(cur.keys() & base.keys()):
+        change = None
+        if base[key]:
+            change = round((cur[key] - base[key]) / abs(base[key]) * 100, 2)
+        changes[key] = {"baseline": base[key], "current": cur[key], "change_pct": change}
+    return {"baseline_commit": baseline.get("meta", {}).get("commit"), "metrics": changes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the knowledge base chatbot")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS), help="Knowledge base directory to index")
+    parser.add_argument("--only", default=",".join(SECTIONS), help=f"Comma-separated sections ({','.join(SECTIONS)})")
+    parser.add_argument("--embeddings", choices=("hf", "hash"), default="hf",
+                        help="hf: configured sentence-transformers model (must be cached); hash: no model")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--retrieval-queries", type=int, default=60, help="Queries per concurrency level")
+    parser.add_argument("--chat-requests", type=int, default=32, help="Chat requests per concurrency level")
+    parser.add_argument("--ocr-files", type=int, default=1, help="Number of PDFs to OCR (smallest first)")
+    parser.add_argument("--ocr-lang", default="jpn_vert")
+    parser.add_argument("--ocr-adaptive", action="store_true",
+                        help="Use adaptive OCR (preprocessing, low first-pass DPI, retry on low confidence)")
+    parser.add_argument("--mock-ttft", type=float, default=0.2, help="Mock OpenAI time to first token (s)")
+    parser.add_argument("--mock-token-delay", type=float, default=0.005, help="Mock OpenAI delay per token (s)")
+    parser.add_argument("--mock-tokens", type=int, default=200, help="Mock OpenAI tokens per answer")
+    parser.add_argument("--startup-timeout", type=float, default=1800, help="Max seconds to wait for app startup")
+    parser.add_argument("--workdir", help="Scratch directory for the index (default: a temp dir)")
+    parser.add_argument("--compare", help="Earlier result JSON to compare against")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c]
+    sections = [s for s in args.only.split(",") if s]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="chatbot-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    setup_environment(args, workdir)
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+    results = {}
+    rag = None
+    if "index" in sections or "retrieval" in sections:
+        rag, index_results = asyncio.run(bench_index(args))
+        if "index" in sections:
+            results["index"] = index_results
+    if "retrieval" in sections:
+        results["retrieval"] = bench_retrieval(rag, args)
+    if "ocr" in sections:
+        results["ocr"] = bench_ocr(args)
+    if "chat" in sections:
+        results["chat"] = bench_chat(args)
+
+    from metrics import STAGE_SECONDS
+    results["stages"] = {
+        labels[0]: {"count": s["count"], "total_seconds": round(s["sum"], 6)}
+        for labels, s in sorted(STAGE_SECONDS.snapshot().items())
+    }
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "embeddings": args.embeddings,
+            "vector_backend": os.environ.get("VECTOR_BACKEND", "chroma"),
+            "corpus": str(Path(args.corpus).resolve()),
+            "sections": sections,
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()